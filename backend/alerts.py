@@ -0,0 +1,195 @@
+"""
+Alertas de baja de precio para los suscriptores de cada query.
+
+Una sola pasada por query: diff_results() compara el snapshot anterior de
+cached_results con el nuevo (mejor precio y precio por tienda), solo entre tiendas
+presentes en ambos: una tienda que falló o se omitió la vez pasada y regresa más
+barata no es una baja de precio. Solo si el mejor precio bajó se leen los suscriptores (una consulta collection_group por query) y
+sus umbrales se evalúan juntos con NumPy. Las notificaciones y el last_alert_price
+de cada tracking se escriben en batches de 500. El costo crece con los productos
+que cambiaron, no con usuarios × productos.
+
+Campos opcionales en users/{uid}/tracking/{query}:
+  alerts_enabled       -> False para no recibir alertas (por defecto True)
+  alert_threshold_pct  -> baja mínima en % (por defecto ALERT_MIN_DROP_PCT)
+  target_price         -> avisar en cuanto el mejor precio llegue a este valor
+  last_alert_price     -> lo escribe el backend: precio de la última alerta enviada
+
+Las notificaciones quedan en users/{uid}/notifications/{query}_{minuto}.
+"""
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from matching import normalize_text
+
+ALERT_MIN_DROP_PCT = float(os.environ.get("ALERT_MIN_DROP_PCT", 5.0))
+BATCH_LIMIT = 500
+IN_QUERY_LIMIT = 30  # máximo de valores en un filtro "in" de Firestore
+
+
+def _prices(results: Optional[List[dict]]) -> Dict[str, dict]:
+    """Mejor resultado exitoso por tienda."""
+    by_store = {}
+    for r in results or []:
+        price = float(r.get("price") or 0)
+        if r.get("status", "success") != "success" or price <= 0:
+            continue
+        if r["store"] not in by_store or price < by_store[r["store"]]["price"]:
+            by_store[r["store"]] = {"price": price, "url": r.get("url"), "name": r.get("name")}
+    return by_store
+
+
+def diff_results(previous: Optional[List[dict]], current: Optional[List[dict]]) -> Optional[dict]:
+    """
+    None si no hay baja; si no, {"best_old", "best_new", "store", "url", "name", "drops": [...]}
+    con las tiendas cuyo precio bajó. Solo cuentan las tiendas presentes en ambos snapshots.
+    """
+    old, new = _prices(previous), _prices(current)
+    common = old.keys() & new.keys()
+    old = {s: v for s, v in old.items() if s in common}
+    new = {s: v for s, v in new.items() if s in common}
+    if not common:
+        return None
+    best_store = min(new, key=lambda s: new[s]["price"])
+    best_new = new[best_store]["price"]
+    best_old = min(v["price"] for v in old.values())
+    if best_new >= best_old:
+        return None
+    drops = [
+        {"store": s, "old": old[s]["price"], "new": v["price"],
+         "drop_pct": round(100 * (old[s]["price"] - v["price"]) / old[s]["price"], 2)}
+        for s, v in new.items() if v["price"] < old[s]["price"]
+    ]
+    if not drops:
+        return None
+    return {"best_old": best_old, "best_new": best_new, "store": best_store,
+            "url": new[best_store]["url"], "name": new[best_store]["name"], "drops": drops}
+
+
+def select_subscribers(diff: dict, subscribers: List[dict]) -> np.ndarray:
+    """Máscara de qué suscriptores reciben alerta (todos los umbrales evaluados juntos)."""
+    n = len(subscribers)
+    if not n:
+        return np.zeros(0, dtype=bool)
+    enabled = np.array([s.get("alerts_enabled", True) is not False for s in subscribers])
+    threshold = np.array([float(s.get("alert_threshold_pct") or ALERT_MIN_DROP_PCT) for s in subscribers])
+    target = np.array([float(s.get("target_price") or 0) for s in subscribers])
+    last_alert = np.array([float(s.get("last_alert_price") or np.nan) for s in subscribers])
+
+    new = diff["best_new"]
+    # Referencia: lo último que se le avisó al usuario, o el snapshot anterior
+    reference = np.where(np.isnan(last_alert), diff["best_old"], last_alert)
+    drop_pct = 100 * (reference - new) / reference
+    by_drop = drop_pct >= threshold
+    by_target = (target > 0) & (new <= target) & (np.isnan(last_alert) | (new < last_alert))
+    return enabled & (new < reference) & (by_drop | by_target)
+
+
+class AlertEngine:
+    """Evalúa queries y acumula las escrituras; flush() las manda en batches."""
+
+    def __init__(self, db):
+        self.db = db
+        self._ops: List[Tuple[str, object, dict]] = []
+        self.stats = {"queries": 0, "changed": 0, "subscribers_read": 0, "alerts": 0, "commits": 0}
+
+    def _subscribers(self, query_terms: List[str]) -> List[Tuple[object, dict]]:
+        """Trackings cuyo campo `query` es cualquiera de las variantes de la query."""
+        out = []
+        for i in range(0, len(query_terms), IN_QUERY_LIMIT):
+            docs = self.db.collection_group("tracking").where("query", "in", query_terms[i:i + IN_QUERY_LIMIT]).stream()
+            out.extend((doc, doc.to_dict() or {}) for doc in docs)
+        return out
+
+    def evaluate(self, query_term: str, previous: Optional[List[dict]], current: Optional[List[dict]],
+                 query_terms: Optional[List[str]] = None) -> int:
+        """`query_terms`: variantes de mayúsculas guardadas por los usuarios (tracked_queries.queries)."""
+        self.stats["queries"] += 1
+        diff = diff_results(previous, current)
+        if not diff or not self.db:
+            return 0
+        self.stats["changed"] += 1
+
+        subscribers = self._subscribers(sorted(set(query_terms or [query_term])))
+        self.stats["subscribers_read"] += len(subscribers)
+        mask = select_subscribers(diff, [data for _, data in subscribers])
+        if not mask.any():
+            return 0
+
+        now = datetime.now()
+        notification_id = f"{normalize_text(query_term).replace(' ', '_') or '_'}_{int(now.timestamp() // 60)}"
+        sent = 0
+        for (doc, data), alert in zip(subscribers, mask):
+            if not alert:
+                continue
+            # users/{uid}/tracking/{id} -> users/{uid}/notifications/{id}
+            user_ref = doc.reference.parent.parent
+            reference = data.get("last_alert_price") or diff["best_old"]
+            self._ops.append(("set", user_ref.collection("notifications").document(notification_id), {
+                "type": "price_drop",
+                "query": query_term,
+                "store": diff["store"],
+                "name": diff["name"],
+                "url": diff["url"],
+                "old_price": reference,
+                "new_price": diff["best_new"],
+                "drop_pct": round(100 * (reference - diff["best_new"]) / reference, 2),
+                "drops": diff["drops"],
+                "created_at": now.isoformat(),
+                "read": False,
+            }))
+            self._ops.append(("update", doc.reference, {
+                "last_alert_price": diff["best_new"],
+                "last_alert_at": now.isoformat(),
+            }))
+            sent += 1
+        self.stats["alerts"] += sent
+        return sent
+
+    def flush(self):
+        if not self.db or not self._ops:
+            return
+        ops, self._ops = self._ops, []
+        try:
+            for i in range(0, len(ops), BATCH_LIMIT):
+                batch = self.db.batch()
+                for kind, ref, data in ops[i:i + BATCH_LIMIT]:
+                    if kind == "set":
+                        batch.set(ref, data)
+                    else:
+                        batch.update(ref, data)
+                batch.commit()
+                self.stats["commits"] += 1
+        except Exception as e:
+            print(f"Error sending price alerts: {e}")
+
+
+def load_snapshots(db, queries: List[str]) -> Dict[str, List[dict]]:
+    """Resultados actuales de cached_results para varias queries en una sola lectura (get_all)."""
+    if not db or not queries:
+        return {}
+    refs = [db.collection("cached_results").document(q.lower()) for q in queries]
+    by_id = {snap.id: (snap.to_dict() or {}).get("results", []) for snap in db.get_all(refs, field_paths=["results"]) if snap.exists}
+    return {q: by_id[q.lower()] for q in queries if q.lower() in by_id}
+
+
+def run_alerts(db, changes: List[Tuple[str, Optional[List[dict]], Optional[List[dict]]]],
+               query_terms: Optional[Dict[str, List[str]]] = None) -> dict:
+    """
+    Evalúa [(query, anteriores, nuevos)] y escribe las alertas. Síncrono: llamar vía firestore_io.
+    `query_terms` mapea cada query a todas sus variantes de mayúsculas (índice tracked_queries).
+    """
+    engine = AlertEngine(db)
+    query_terms = query_terms or {}
+    for query_term, previous, current in changes:
+        try:
+            engine.evaluate(query_term, previous, current, query_terms.get(query_term))
+        except Exception as e:
+            print(f"Error evaluating alerts for {query_term}: {e}")
+    engine.flush()
+    if engine.stats["alerts"]:
+        print(f"🔔 [Alerts] {engine.stats['alerts']} alertas para {engine.stats['changed']} productos con baja de precio")
+    return engine.stats
@@ -0,0 +1,126 @@
+"""
+Benchmark offline del scraper sobre fixtures grabados (ver fixtures.py).
+
+Grabar (una vez, contra las tiendas reales):
+    python benchmark.py --record "rtx 5070" "ryzen 7 7800x3d"
+Medir (offline, reproduciendo los fixtures):
+    python benchmark.py "rtx 5070" "ryzen 7 7800x3d" --repeat 5 --json bench.json
+
+Reporta por tienda: páginas/s, motor usado (http/browser), latencia por fase
+(fetch, context, goto, wait, extract, match),
+p50/p95 del total y el ganador extraído para cada query (para validar que una
+optimización no cambió el resultado).
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import List
+
+import fixtures
+from main import STORES, crawl_store, pick_winner, browser_pool, listing_cache
+from static_fetch import close_client
+
+PHASES = ["fetch", "context", "goto", "wait", "extract", "match"]
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+async def crawl_once(store, query):
+    crawl = None
+    async for event in crawl_store(store, query):
+        if event["type"] == "crawl":
+            crawl = event
+    return crawl
+
+
+async def run(queries: List[str], repeat: int) -> dict:
+    report = {"mode": fixtures.MODE or "live", "queries": queries, "repeat": repeat, "stores": {}}
+    start = time.perf_counter()
+    pages = 0
+    # Medimos páginas reales: la caché de listados quedaría sirviendo las repeticiones
+    listing_cache.ttl_s = 0
+    try:
+        # Calentar el pool para no contar el arranque de Chromium en la primera página
+        await browser_pool.start()
+        for store in STORES:
+            store_start = time.perf_counter()
+            phases = {phase: [] for phase in PHASES}
+            totals, winners, statuses, engines = [], {}, {}, {}
+            network = {"pages": 0, "requests": 0, "blocked": 0, "bytes": 0}
+            for query in queries:
+                for _ in range(repeat):
+                    crawl = await crawl_once(store, query)
+                    pages += 1
+                    statuses[crawl["status"]] = statuses.get(crawl["status"], 0) + 1
+                    engines[crawl.get("engine")] = engines.get(crawl.get("engine"), 0) + 1
+                    for phase, secs in crawl["timings"].items():
+                        phases[phase].append(secs)
+                    totals.append(sum(crawl["timings"].values()))
+                    if crawl.get("network"):
+                        network["pages"] += 1
+                        for key in ("requests", "blocked", "bytes"):
+                            network[key] += crawl["network"][key]
+                winner = pick_winner(store, query, crawl)
+                winners[query] = {k: winner.get(k) for k in ("status", "match_type", "name", "price", "url")}
+            elapsed = time.perf_counter() - store_start
+            report["stores"][store["name"]] = {
+                "pages": len(totals),
+                "pages_per_s": round(len(totals) / elapsed, 2) if elapsed else 0.0,
+                "statuses": statuses,
+                "engines": engines,
+                "phase_avg_ms": {p: round(1000 * sum(v) / len(v), 1) for p, v in phases.items() if v},
+                "total_p50_ms": round(1000 * percentile(totals, 50), 1),
+                "total_p95_ms": round(1000 * percentile(totals, 95), 1),
+                "network_avg": {k: round(v / network["pages"], 1) for k, v in network.items() if k != "pages"}
+                               if network["pages"] else {},
+                "winners": winners,
+            }
+    finally:
+        await browser_pool.close()
+        await close_client()
+        fixtures.replay_server.stop()
+    elapsed = time.perf_counter() - start
+    report["pages"] = pages
+    report["pages_per_s"] = round(pages / elapsed, 2) if elapsed else 0.0
+    return report
+
+
+def print_report(report: dict):
+    print(f"\n📊 Benchmark ({report['mode']}): {report['pages']} páginas, {report['pages_per_s']} páginas/s")
+    for name, s in report["stores"].items():
+        phases = "  ".join(f"{p}={ms}ms" for p, ms in s["phase_avg_ms"].items())
+        print(f"\n🏪 {name}: {s['pages_per_s']} páginas/s  p50={s['total_p50_ms']}ms  p95={s['total_p95_ms']}ms  {s['statuses']} {s['engines']}")
+        print(f"   {phases}")
+        if s["network_avg"]:
+            n = s["network_avg"]
+            print(f"   red/página: {n['requests']} requests, {n['blocked']} bloqueados, {n['bytes'] / 1024:.0f} KB")
+        for query, w in s["winners"].items():
+            price = f"${w['price']:,.2f}" if w.get("price") else "-"
+            print(f"   • {query}: {w['status']} {w.get('match_type') or ''} {price} {(w.get('name') or '')[:50]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline de extracción por tienda")
+    parser.add_argument("queries", nargs="+")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--record", action="store_true", help="Grabar fixtures desde las tiendas reales")
+    parser.add_argument("--json", help="Guardar el reporte en este archivo")
+    args = parser.parse_args()
+
+    fixtures.set_mode("record" if args.record else "replay")
+    report = asyncio.run(run(args.queries, 1 if args.record else args.repeat))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Caché en memoria para el API.
+
+- TTLCache: LRU con expiración por entrada y tope de memoria (entradas y bytes aproximados).
+- SingleFlight: si varias peticiones piden la misma clave a la vez, solo una ejecuta el
+  trabajo (un scrape con Chromium) y todas reciben la misma secuencia de eventos.
+"""
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, Dict, Optional
+
+
+class TTLCache:
+    def __init__(self, ttl_s: float = 600, max_entries: int = 512, max_bytes: int = 16 * 1024 * 1024):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _size(value) -> int:
+        try:
+            return len(json.dumps(value, default=str))
+        except Exception:
+            return 1024
+
+    def get(self, key: str):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, _, value = entry
+        if expires_at < time.monotonic():
+            self._drop(key)
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value, ttl_s: Optional[float] = None):
+        ttl = self.ttl_s if ttl_s is None else ttl_s
+        if ttl <= 0:
+            return
+        size = self._size(value)
+        if size > self.max_bytes:
+            return
+        if key in self._data:
+            self._drop(key)
+        self._data[key] = (time.monotonic() + ttl, size, value)
+        self._bytes += size
+        # Desalojo LRU hasta respetar ambos topes
+        while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._data))
+            self._drop(oldest)
+
+    def invalidate(self, key: str):
+        if key in self._data:
+            self._drop(key)
+
+    def _drop(self, key: str):
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def stats(self) -> dict:
+        return {"entries": len(self._data), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+
+
+class _Flight:
+    def __init__(self):
+        self.events = []
+        self.done = False
+        self.cond = asyncio.Condition()
+        self.task: Optional[asyncio.Task] = None
+
+
+class SingleFlight:
+    """
+    Coalescencia de peticiones concurrentes por clave.
+    El productor corre en su propia tarea: si el primer cliente se desconecta, el trabajo
+    sigue para los demás suscriptores. Los que llegan tarde reciben el replay completo.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._flights
+
+    async def stream(self, key: str, factory: Callable[[], AsyncIterator]) -> AsyncIterator:
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight()
+            self._flights[key] = flight
+            flight.task = asyncio.create_task(self._produce(key, flight, factory))
+
+        sent = 0
+        while True:
+            async with flight.cond:
+                await flight.cond.wait_for(lambda: len(flight.events) > sent or flight.done)
+                batch = flight.events[sent:]
+                finished = flight.done
+            for event in batch:
+                sent += 1
+                yield event
+            if finished and sent >= len(flight.events):
+                return
+
+    async def _produce(self, key: str, flight: _Flight, factory: Callable[[], AsyncIterator]):
+        try:
+            async for event in factory():
+                async with flight.cond:
+                    flight.events.append(event)
+                    flight.cond.notify_all()
+        except Exception as e:
+            async with flight.cond:
+                flight.events.append({"type": "log", "message": f"Error crítico: {e}"})
+        finally:
+            async with flight.cond:
+                flight.done = True
+                flight.cond.notify_all()
+            self._flights.pop(key, None)
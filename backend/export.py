@@ -0,0 +1,131 @@
+"""
+Export completo de cached_results y store_options sin cargar todo en memoria.
+
+Las colecciones se leen página por página (orden por id de documento y
+start_after), cada página se aplana en filas y se escribe antes de pedir la
+siguiente: la memoria pico es una página (PAGE_SIZE documentos) sin importar el
+tamaño del catálogo.
+
+  GET /export?collections=cached_results,store_options   -> NDJSON en streaming
+  python export.py --out dump.ndjson.gz                   -> NDJSON (gzip si termina en .gz)
+  python export.py --format parquet --out dump.parquet    -> Parquet con zstd, un row group por página
+
+Parquet necesita pyarrow (pip install pyarrow); no está en requirements.txt para
+no engordar el deploy del API.
+"""
+import argparse
+import gzip
+import json
+import os
+from typing import Iterator, List, Optional
+
+COLLECTIONS = ("cached_results", "store_options")
+PAGE_SIZE = int(os.environ.get("EXPORT_PAGE_SIZE", 300))
+
+# Esquema fijo de las filas (columnas del archivo columnar)
+FIELDS = ["collection", "query_term", "store", "name", "price", "status", "url", "match_score", "updated_at"]
+
+
+def fetch_page(db, collection: str, after_id: Optional[str] = None, page_size: int = PAGE_SIZE) -> list:
+    """Una página de documentos ordenados por id; after_id = último id de la página anterior."""
+    query = db.collection(collection).order_by("__name__").limit(page_size)
+    if after_id is not None:
+        query = query.start_after({"__name__": db.collection(collection).document(after_id)})
+    return list(query.stream())
+
+
+def flatten(collection: str, doc_id: str, data: dict) -> List[dict]:
+    query_term = data.get("query_term", doc_id)
+    updated_at = data.get("updated_at")
+    items = data.get("results" if collection == "cached_results" else "options") or []
+    return [{
+        "collection": collection,
+        "query_term": query_term,
+        "store": item.get("store"),
+        "name": item.get("name"),
+        "price": float(item["price"]) if item.get("price") is not None else None,
+        "status": item.get("status", "success" if collection == "store_options" else None),
+        "url": item.get("url"),
+        "match_score": item.get("match_score"),
+        "updated_at": updated_at,
+    } for item in items]
+
+
+def iter_pages(db, collections=COLLECTIONS, page_size: int = PAGE_SIZE) -> Iterator[List[dict]]:
+    """Filas aplanadas, una lista por página de documentos."""
+    for collection in collections:
+        after_id = None
+        while True:
+            docs = fetch_page(db, collection, after_id, page_size)
+            if not docs:
+                break
+            rows = []
+            for doc in docs:
+                rows.extend(flatten(collection, doc.id, doc.to_dict() or {}))
+            yield rows
+            if len(docs) < page_size:
+                break
+            after_id = docs[-1].id
+
+
+def write_ndjson(db, out_path: str, collections=COLLECTIONS) -> int:
+    opener = gzip.open if out_path.endswith(".gz") else open
+    total = 0
+    with opener(out_path, "wt", encoding="utf-8") as f:
+        for rows in iter_pages(db, collections):
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            total += len(rows)
+    return total
+
+
+def write_parquet(db, out_path: str, collections=COLLECTIONS) -> int:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("El formato parquet requiere pyarrow: pip install pyarrow")
+
+    schema = pa.schema([
+        ("collection", pa.string()), ("query_term", pa.string()), ("store", pa.string()),
+        ("name", pa.string()), ("price", pa.float64()), ("status", pa.string()), ("url", pa.string()),
+        ("match_score", pa.float64()), ("updated_at", pa.string()),
+    ])
+    total = 0
+    with pq.ParquetWriter(out_path, schema, compression="zstd") as writer:
+        for rows in iter_pages(db, collections):
+            if not rows:
+                continue
+            columns = {field: [row[field] for row in rows] for field in FIELDS}
+            columns["match_score"] = [float(v) if v is not None else None for v in columns["match_score"]]
+            writer.write_table(pa.table(columns, schema=schema))
+            total += len(rows)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export de cached_results / store_options")
+    parser.add_argument("--out", required=True, help="Archivo de salida (.ndjson, .ndjson.gz o .parquet)")
+    parser.add_argument("--format", choices=["ndjson", "parquet"], default=None,
+                        help="Por defecto se deduce de la extensión de --out")
+    parser.add_argument("--collections", default=",".join(COLLECTIONS))
+    args = parser.parse_args()
+
+    collections = [c for c in args.collections.split(",") if c]
+    unknown = set(collections) - set(COLLECTIONS)
+    if unknown:
+        parser.error(f"Colecciones no soportadas: {', '.join(sorted(unknown))}")
+    fmt = args.format or ("parquet" if args.out.endswith(".parquet") else "ndjson")
+
+    import asyncio
+    from main import ensure_firebase
+    db = asyncio.run(ensure_firebase())
+    if not db:
+        raise SystemExit("Firebase no disponible")
+
+    total = (write_parquet if fmt == "parquet" else write_ndjson)(db, args.out, collections)
+    print(f"📦 {total} filas exportadas a {args.out} ({fmt})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Acceso a Firestore sin bloquear el event loop.
+
+El SDK de firebase_admin es síncrono: cada get/set/stream es un round-trip de red
+que, llamado desde una corutina, congela todos los streams SSE y las páginas de
+Playwright del proceso. call() corre la función en un pool de hilos acotado
+(FIRESTORE_WORKERS) con timeout (FIRESTORE_TIMEOUT_S) y regresa `default` si
+falla o tarda de más, igual que los helpers de main.py ante errores.
+
+El timeout libera al llamador; el hilo termina su llamada por su cuenta (el SDK
+no se puede cancelar a medias), por eso el pool es acotado.
+"""
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+import metrics
+
+WORKERS = int(os.environ.get("FIRESTORE_WORKERS", 8))
+TIMEOUT_S = float(os.environ.get("FIRESTORE_TIMEOUT_S", 15))
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="firestore")
+    return _executor
+
+
+async def call(fn: Callable, *args, op: str = "", timeout: Optional[float] = TIMEOUT_S, default: Any = None, **kwargs):
+    """await call(get_cached_results, "rtx 5070", op="get_cached_results", default=[])"""
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(executor(), functools.partial(fn, *args, **kwargs))
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        metrics.inc("firestore_timeouts_total", op=op or getattr(fn, "__name__", "?"))
+        print(f"⏱️ [Firestore] {op or getattr(fn, '__name__', '?')} excedió {timeout}s")
+        return default
+    except Exception as e:
+        print(f"⚠️ [Firestore] Error en {op or getattr(fn, '__name__', '?')}: {e}")
+        return default
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
@@ -0,0 +1,124 @@
+"""
+Modo grabar / reproducir páginas de búsqueda para medir el scraper sin tocar las tiendas.
+
+SCRAPER_FIXTURES=record  -> cada crawl guarda el DOM renderado de la página de búsqueda
+                            (o el HTML del servidor si la resolvió static_fetch)
+                            en fixtures/{tienda}/{query}.html (+ .json con metadatos).
+SCRAPER_FIXTURES=replay  -> las URLs de búsqueda se redirigen a un servidor HTTP local que
+                            sirve esos archivos; cualquier otra petición se bloquea.
+
+El DOM se guarda ya renderado, sin <script>, y con <base href> apuntando a la URL real:
+la reproducción es determinista y los links relativos siguen resolviendo a la tienda.
+"""
+import html as html_lib
+import json
+import os
+import re
+import threading
+import unicodedata
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import unquote
+
+MODE = os.environ.get("SCRAPER_FIXTURES", "").lower()
+FIXTURES_DIR = os.environ.get(
+    "SCRAPER_FIXTURES_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+)
+
+_SCRIPT_RE = re.compile(r"<script\b[^>]*>.*?</script\s*>", re.IGNORECASE | re.DOTALL)
+_HEAD_RE = re.compile(r"<head[^>]*>", re.IGNORECASE)
+
+
+def set_mode(mode: str):
+    global MODE
+    MODE = (mode or "").lower()
+
+
+def slug(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"[^a-z0-9]+", "_", text.lower()).strip("_") or "_"
+
+
+def fixture_file(store_name: str, query: str) -> str:
+    return os.path.join(FIXTURES_DIR, slug(store_name), slug(query) + ".html")
+
+
+def record(store: dict, query: str, live_url: str, html: str):
+    """Guarda el DOM renderado listo para reproducirse offline."""
+    path = fixture_file(store["name"], query)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    html = _SCRIPT_RE.sub("", html)
+    base = f'<base href="{html_lib.escape(live_url, quote=True)}">'
+    html = _HEAD_RE.sub(lambda m: m.group(0) + base, html, count=1) if _HEAD_RE.search(html) else base + html
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(html)
+    with open(path[:-5] + ".json", "w", encoding="utf-8") as f:
+        json.dump({"store": store["name"], "query": query, "url": live_url,
+                   "recorded_at": datetime.now().isoformat()}, f, ensure_ascii=False, indent=2)
+    print(f"📸 Fixture guardado: {path}")
+
+
+class _FixtureHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        parts = [unquote(p) for p in self.path.split("?")[0].strip("/").split("/")]
+        path = os.path.join(FIXTURES_DIR, *parts) + ".html" if len(parts) == 2 else None
+        if not path or not os.path.exists(path):
+            self.send_response(404)
+            self.end_headers()
+            return
+        with open(path, "rb") as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ReplayServer:
+    """Servidor HTTP local que hace las veces de cada tienda en modo replay."""
+
+    def __init__(self):
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._lock = threading.Lock()
+
+    @property
+    def origin(self) -> str:
+        self.start()
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        with self._lock:
+            if self._server:
+                return
+            self._server = ThreadingHTTPServer(("127.0.0.1", 0), _FixtureHandler)
+            threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        with self._lock:
+            if self._server:
+                self._server.shutdown()
+                self._server.server_close()
+                self._server = None
+
+    def url_for(self, store_name: str, query: str) -> str:
+        return f"{self.origin}/{slug(store_name)}/{slug(query)}"
+
+
+replay_server = ReplayServer()
+
+
+def resolve_search_url(store: dict, query: str, live_url: str) -> str:
+    """En modo replay la URL de búsqueda de la tienda apunta al servidor local."""
+    if MODE == "replay":
+        return replay_server.url_for(store["name"], query)
+    return live_url
+
+
+def is_replay_url(url: str) -> bool:
+    return MODE == "replay" and url.startswith(replay_server.origin)
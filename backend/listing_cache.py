@@ -0,0 +1,116 @@
+"""
+Caché persistente de listados por (tienda, query normalizada).
+
+"RTX 5070TI" y "rtx 5070 ti" normalizan igual y cargan la misma página de
+búsqueda; el listado crudo extraído (items con título, precio y link) se guarda
+en SQLite con TTL y cualquier crawl dentro del TTL lo reutiliza: la query del
+API, la del scraper programado y la pasada de opciones. Se guarda el listado
+crudo (no los candidatos) para que el matching siempre corra con la query real.
+
+El archivo vive en LISTING_CACHE_PATH (por defecto backend/.cache/listings.sqlite).
+El TTL (20 min) es menor que la cadencia del cron (30 min) a propósito: una query
+vencida debe ver precios nuevos, no el listado de la corrida anterior. Por eso la
+caché sirve dentro de una corrida (y en el API entre requests) y el workflow no la
+restaura entre corridas; store_health.json y selector_stats.json sí.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from matching import normalize_text
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "listings.sqlite")
+
+
+class ListingCache:
+    def __init__(self, path: str = DEFAULT_PATH, ttl_s: float = 20 * 60):
+        self.path = path
+        self.ttl_s = ttl_s
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "writes": 0}
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            # timeout: varios procesos del scraper (sharding.run_local) comparten el archivo
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS listings ("
+                " store TEXT NOT NULL, query TEXT NOT NULL, fetched_at REAL NOT NULL,"
+                " url TEXT, engine TEXT, status TEXT NOT NULL, items TEXT NOT NULL,"
+                " PRIMARY KEY (store, query))"
+            )
+        return self._conn
+
+    @staticmethod
+    def key(store: dict, query: str):
+        return store["name"], normalize_text(query)
+
+    def _fresh_row(self, store: dict, query: str):
+        """(fila, edad) del listado vigente o None."""
+        if self.ttl_s <= 0:
+            return None
+        try:
+            with self._lock:
+                row = self._db().execute(
+                    "SELECT fetched_at, url, engine, status, items FROM listings WHERE store = ? AND query = ?",
+                    self.key(store, query),
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"⚠️ [ListingCache] Error leyendo: {e}")
+            return None
+        age = time.time() - row[0] if row else None
+        if row is None or age > self.ttl_s:
+            return None
+        return row, age
+
+    def has(self, store: dict, query: str) -> bool:
+        """Hay un listado vigente; no cuenta en stats (el scheduler lo consulta antes de cobrar el limitador)."""
+        return self._fresh_row(store, query) is not None
+
+    def get(self, store: dict, query: str) -> Optional[dict]:
+        """{"status", "url", "engine", "items", "age_s"} si hay un listado vigente."""
+        if self.ttl_s <= 0:
+            return None
+        found = self._fresh_row(store, query)
+        if found is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        row, age = found
+        return {"status": row[3], "url": row[1], "engine": row[2], "items": json.loads(row[4]), "age_s": round(age, 1)}
+
+    def put(self, store: dict, query: str, status: str, items: list, url: str = "", engine: str = ""):
+        if self.ttl_s <= 0:
+            return
+        try:
+            with self._lock:
+                self._db().execute(
+                    "INSERT OR REPLACE INTO listings (store, query, fetched_at, url, engine, status, items)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (*self.key(store, query), time.time(), url, engine, status, json.dumps(items, ensure_ascii=False)),
+                )
+            self.stats["writes"] += 1
+        except sqlite3.Error as e:
+            print(f"⚠️ [ListingCache] Error guardando: {e}")
+
+    def prune(self) -> int:
+        """Borra los listados vencidos (se llama al cerrar la corrida)."""
+        try:
+            with self._lock:
+                cur = self._db().execute("DELETE FROM listings WHERE fetched_at < ?", (time.time() - self.ttl_s,))
+            return cur.rowcount
+        except sqlite3.Error:
+            return 0
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
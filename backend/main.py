@@ -1,7 +1,7 @@
-import re
 import asyncio
 import random
 import os
+import time
 from datetime import datetime, timedelta
 from typing import List, Optional
 from urllib.parse import urljoin
@@ -10,133 +10,354 @@ from contextlib import asynccontextmanager
 import json
 from fastapi import FastAPI, Query, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, Response
 from pydantic import BaseModel
 from playwright.async_api import async_playwright
 
+import fixtures
+import export
+import firestore_io
+import metrics
+from cache import TTLCache, SingleFlight
+from static_fetch import fetch_listing, close_client
+from write_buffer import WriteBuffer, content_hash
+from price_history import load_series as load_price_series, window_stats
+from tracked_index import TrackedIndexMaintainer, read_index as read_tracked_index, rebuild as rebuild_tracked_index, is_stale as tracked_index_is_stale
+from products_snapshot import ProductsSnapshot, render_rows
+from scheduler import limiter_for
+from alerts import run_alerts
+from listing_cache import ListingCache, DEFAULT_PATH as LISTING_CACHE_DEFAULT_PATH
+from network_policy import NetworkGuard, policy_for
+from store_health import StoreHealth, DEFAULT_PATH as STORE_HEALTH_DEFAULT_PATH
+from selector_stats import SelectorStats, DEFAULT_PATH as SELECTOR_STATS_DEFAULT_PATH
+from matching import normalize_text, compile_query, score_batch, rank, select as select_ranked
+
 import firebase_admin
 from firebase_admin import credentials, firestore, auth
 
-# --- HACK PARA RENDER: INSTALAR NAVEGADOR AL ARRANQUE ---
-# --- HACK PARA RENDER: INSTALAR NAVEGADOR AL ARRANQUE ---
 import sys
+import glob
 import subprocess
-try:
-    subprocess.check_call([sys.executable, "-m", "playwright", "install", "chromium"])
-    print("✅ Chromium instalado correctamente.")
-except Exception as e:
-    print(f"❌ Error instalando Chromium: {e}")
-# -------------------------------------------------------
-# -------------------------------------------------------
-
-# --- INICIALIZACIÓN DE FIREBASE (IDEMPOTENTE) ---
-try:
-    if not firebase_admin._apps:
-        # 1. Archivo local de credenciales
-        if os.path.exists("ServiceAccountPriceHunterMx.json"):
-            cred = credentials.Certificate("ServiceAccountPriceHunterMx.json")
-            firebase_admin.initialize_app(cred)
-        # 2. Variable de entorno (GitHub Actions / CI / Deploy)
-        elif os.environ.get("FIREBASE_CREDENTIALS_JSON"):
-            cred_dict = json.loads(os.environ.get("FIREBASE_CREDENTIALS_JSON"))
-            cred = credentials.Certificate(cred_dict)
-            firebase_admin.initialize_app(cred)
+
+# --- ARRANQUE PEREZOSO (Chromium + Firebase) ---
+# Nada pesado corre al importar el módulo: cada componente se inicializa una sola vez
+# cuando alguien lo necesita (o en segundo plano desde lifespan) y /ready reporta su estado.
+db = None
+READINESS = {"firebase": "pending", "chromium": "pending"}
+_init_locks = {"firebase": asyncio.Lock(), "chromium": asyncio.Lock()}
+
+def _init_firebase():
+    """INICIALIZACIÓN DE FIREBASE (IDEMPOTENTE). Corre en un hilo."""
+    global db
+    try:
+        if not firebase_admin._apps:
+            # 1. Archivo local de credenciales
+            if os.path.exists("ServiceAccountPriceHunterMx.json"):
+                cred = credentials.Certificate("ServiceAccountPriceHunterMx.json")
+                firebase_admin.initialize_app(cred)
+            # 2. Variable de entorno (GitHub Actions / CI / Deploy)
+            elif os.environ.get("FIREBASE_CREDENTIALS_JSON"):
+                cred_dict = json.loads(os.environ.get("FIREBASE_CREDENTIALS_JSON"))
+                cred = credentials.Certificate(cred_dict)
+                firebase_admin.initialize_app(cred)
+            else:
+                # 3. Credenciales implícitas (Cloud Run / GCP runtime)
+                firebase_admin.initialize_app()
+            print("🔥 Firebase inicializado por primera vez.")
         else:
-            # 3. Credenciales implícitas (Cloud Run / GCP runtime)
-            firebase_admin.initialize_app()
-        print("🔥 Firebase inicializado por primera vez.")
-    else:
-        print("ℹ️ Firebase ya inicializado; reutilizando app existente.")
-    db = firestore.client()
-    print("🔥 Firebase conectado exitosamente.")
-except Exception as e:
-    print(f"⚠️ Error conectando a Firebase: {e}")
-    db = None
+            print("ℹ️ Firebase ya inicializado; reutilizando app existente.")
+        db = firestore.client()
+        READINESS["firebase"] = "ready"
+        print("🔥 Firebase conectado exitosamente.")
+    except Exception as e:
+        print(f"⚠️ Error conectando a Firebase: {e}")
+        READINESS["firebase"] = f"error: {e}"
+        db = None
+
+async def ensure_firebase():
+    """Inicializa Firebase una sola vez (en un hilo) y regresa el cliente o None."""
+    if READINESS["firebase"] == "pending":
+        async with _init_locks["firebase"]:
+            if READINESS["firebase"] == "pending":
+                await asyncio.to_thread(_init_firebase)
+    return db
+
+def chromium_installed() -> bool:
+    """Ruta rápida: ¿ya hay un Chromium de Playwright en disco? (sin levantar el driver)"""
+    roots = [os.environ.get("PLAYWRIGHT_BROWSERS_PATH"),
+             os.path.expanduser("~/.cache/ms-playwright"),
+             os.path.expanduser("~/Library/Caches/ms-playwright"),
+             os.path.join(os.environ.get("LOCALAPPDATA", ""), "ms-playwright")]
+    return any(root and glob.glob(os.path.join(root, "chromium*")) for root in roots)
+
+async def ensure_chromium(force: bool = False) -> bool:
+    """Instala Chromium solo si hace falta (antes: HACK PARA RENDER en cada import)."""
+    if READINESS["chromium"] == "ready" and not force:
+        return True
+    async with _init_locks["chromium"]:
+        if READINESS["chromium"] == "ready" and not force:
+            return True
+        if not force and chromium_installed():
+            READINESS["chromium"] = "ready"
+            return True
+        try:
+            await asyncio.to_thread(subprocess.check_call, [sys.executable, "-m", "playwright", "install", "chromium"])
+            print("✅ Chromium instalado correctamente.")
+            READINESS["chromium"] = "ready"
+        except Exception as e:
+            print(f"❌ Error instalando Chromium: {e}")
+            READINESS["chromium"] = f"error: {e}"
+    return READINESS["chromium"] == "ready"
 
-# --- BACKGROUND TASKS ---
+# --- POOL DE NAVEGADORES (COMPARTIDO) ---
+BROWSER_ARGS = ["--disable-blink-features=AutomationControlled"]
 
-async def scrape_and_cache(query_term: str):
+class BrowserPool:
     """
-    Versión silenciosa de scrape_stream para el background worker.
+    Mantiene uno o pocos Chromium vivos durante toda la corrida y presta contextos.
+    Los contextos se reutilizan hasta `max_context_uses` préstamos y cada navegador
+    se relanza tras servir `max_browser_contexts` contextos (evita fugas de memoria).
     """
-    print(f"🔄 [Background] Actualizando: {query_term}")
-    playwright = None
-    browser = None
-    try:
-        playwright = await async_playwright().start()
-        browser = await playwright.chromium.launch(
-            headless=True, 
-            args=["--disable-blink-features=AutomationControlled"]
-        )
-        
-        results_for_cache = []
-        for store in STORES:
+
+    def __init__(self, size: int = 1, max_contexts: int = 6, max_context_uses: int = 20, max_browser_contexts: int = 200):
+        self.size = size
+        self.max_context_uses = max_context_uses
+        self.max_browser_contexts = max_browser_contexts
+        self._max_contexts = max_contexts
+        self._playwright = None
+        self._browsers: List[dict] = []   # {"browser", "served", "active", "retired"}
+        self._idle: List[dict] = []       # {"context", "uses", "entry"}
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._lock = asyncio.Lock()
+        self._next = 0
+
+    @property
+    def started(self) -> bool:
+        return self._playwright is not None
+
+    async def start(self):
+        if self._playwright:
+            return
+        await ensure_chromium()
+        async with self._lock:
+            if self._playwright:
+                return
+            self._playwright = await async_playwright().start()
+            self._slots = asyncio.Semaphore(self._max_contexts)
             try:
-                # Reutilizamos search_store (que es un generador)
-                async for event in search_store(browser, store, query_term):
-                    if event["type"] == "result":
-                        result = event["data"]
-                        if result['status'] == 'success':
-                            results_for_cache.append(result)
+                first = await self._launch()
             except Exception as e:
-                print(f"❌ [Background] Error en {store['name']} para {query_term}: {e}")
+                # El Chromium en disco no corresponde a esta versión de Playwright: reinstalar una vez
+                if "Executable doesn't exist" not in str(e) or not await ensure_chromium(force=True):
+                    await self._playwright.stop()
+                    self._playwright = None
+                    raise
+                first = await self._launch()
+            self._browsers.append(first)
+            for _ in range(self.size - 1):
+                self._browsers.append(await self._launch())
+            print(f"🕷️ [Pool] {self.size} navegador(es) Chromium listos.")
+
+    async def _launch(self) -> dict:
+        with metrics.span("browser_launch_seconds"):
+            browser = await self._playwright.chromium.launch(headless=True, args=BROWSER_ARGS)
+        return {"browser": browser, "served": 0, "active": 0, "retired": False}
+
+    async def _new_context(self, entry: dict) -> dict:
+        context = await entry["browser"].new_context(
+            user_agent=random.choice(USER_AGENTS),
+            viewport={"width": 1920, "height": 1080},
+            locale="es-MX",
+            timezone_id="America/Mexico_City"
+        )
+        lease = {"context": context, "uses": 0, "entry": entry, "network": None}
+        # Una sola vez por contexto: stealth y el route que delega en la política del préstamo en curso
+        await apply_stealth_manual(context)
+        await context.route("**/*", lambda route: self._route(lease, route))
+        return lease
+
+    @staticmethod
+    async def _route(lease: dict, route):
+        guard = lease["network"]
+        if guard is None:
+            await route.continue_()
+        else:
+            await guard.handle(route)
+
+    async def _acquire(self):
+        async with self._lock:
+            # 1. Reutilizar un contexto ocioso de un navegador sano
+            while self._idle:
+                lease = self._idle.pop()
+                entry = lease["entry"]
+                if not entry["retired"] and entry["browser"].is_connected():
+                    entry["active"] += 1
+                    return lease
+                await self._close_context(lease)
+
+            # 2. Crear contexto nuevo en el siguiente navegador (round-robin)
+            idx = self._next % len(self._browsers)
+            self._next += 1
+            entry = self._browsers[idx]
+            if entry["served"] >= self.max_browser_contexts or not entry["browser"].is_connected():
+                entry["retired"] = True
+                await self._maybe_close_browser(entry)
+                entry = await self._launch()
+                self._browsers[idx] = entry
+                print("♻️ [Pool] Navegador reciclado.")
+            entry["served"] += 1
+            entry["active"] += 1
+
+        return await self._new_context(entry)
+
+    async def _release(self, lease: dict, healthy: bool):
+        entry = lease["entry"]
+        lease["uses"] += 1
+        try:
+            for page in list(lease["context"].pages):
+                await page.close()
+        except Exception:
+            healthy = False
+
+        async with self._lock:
+            entry["active"] -= 1
+            if healthy and not entry["retired"] and lease["uses"] < self.max_context_uses and self.started:
+                self._idle.append(lease)
+                return
+        await self._close_context(lease)
 
-        if results_for_cache:
+    async def _close_context(self, lease: dict):
+        try:
+            await lease["context"].close()
+        except Exception:
+            pass
+        await self._maybe_close_browser(lease["entry"])
+
+    async def _maybe_close_browser(self, entry: dict):
+        if entry["retired"] and entry["active"] <= 0:
+            try:
+                await entry["browser"].close()
+            except Exception:
+                pass
+
+    @asynccontextmanager
+    async def lease(self, network: Optional[NetworkGuard] = None):
+        """Presta un contexto de navegador; se devuelve al pool al salir.
+        `network` aplica la política de red de la tienda a todo el tráfico del préstamo."""
+        await self.start()
+        async with self._slots:
+            lease = await self._acquire()
+            lease["network"] = network
+            healthy = True
+            try:
+                yield lease["context"]
+            except BaseException:
+                healthy = False
+                raise
+            finally:
+                lease["network"] = None
+                await self._release(lease, healthy)
+
+    async def close(self):
+        """Cierra contextos, navegadores y Playwright. Idempotente."""
+        async with self._lock:
+            if not self._playwright:
+                return
+            for lease in self._idle:
+                try:
+                    await lease["context"].close()
+                except Exception:
+                    pass
+            for entry in self._browsers:
+                try:
+                    await entry["browser"].close()
+                except Exception:
+                    pass
+            try:
+                await self._playwright.stop()
+            except Exception:
+                pass
+            self._idle = []
+            self._browsers = []
+            self._playwright = None
+            print("🛑 [Pool] Navegadores cerrados.")
+
+browser_pool = BrowserPool(
+    size=int(os.environ.get("BROWSER_POOL_SIZE", 1)),
+    max_contexts=int(os.environ.get("BROWSER_POOL_MAX_CONTEXTS", 6)),
+)
+
+# --- BACKGROUND TASKS ---
+
+async def scrape_store_once(store, query_term: str, options_limit: int = 10, fresh: bool = False, paced: bool = False):
+    """
+    Consume search_store para una tienda y regresa (resultado, opciones) sin logs.
+    paced=True cuando el llamador (ScrapeScheduler) ya tomó cupo y pausa de la tienda
+    (no lo hace si el listado está en listing_cache, ver listing_is_cached).
+    """
+    result, options = None, []
+    async for event in search_store(store, query_term, options_limit=options_limit, fresh=fresh, paced=paced):
+        if event["type"] == "result":
+            result = event["data"]
+        elif event["type"] == "options":
+            options = event["data"]
+    return result, options
+
+def persist_scrape(query_term: str, results_for_cache: List[dict], all_options: List[dict], buffer: Optional[WriteBuffer] = None,
+                   query_terms: Optional[List[str]] = None):
+    """
+    Guarda ganadores (cached_results) y opciones (store_options) de una query.
+    Con `buffer` las escrituras se difieren al flush (batch + se omiten las que no cambiaron).
+    `query_terms`: variantes de mayúsculas de los trackings a tocar (por defecto solo query_term).
+    """
+    if results_for_cache:
+        if buffer is not None:
+            buffer.set_doc("cached_results", query_term.lower(), cached_results_doc(query_term, results_for_cache),
+                           touch_query=query_terms or query_term)
+        else:
             save_results_to_cache(query_term, results_for_cache)
             update_tracked_query_timestamp(query_term)
-            print(f"✅ [Background] Guardados {len(results_for_cache)} resultados para {query_term}")
-        else:
-            print(f"⚠️ [Background] No se encontraron resultados para {query_term}")
+        print(f"✅ [Background] Guardados {len(results_for_cache)} resultados para {query_term}")
+    else:
+        print(f"⚠️ [Background] No se encontraron resultados para {query_term}")
 
-    except Exception as e:
-        print(f"💥 [Background] Error crítico para {query_term}: {e}")
-    finally:
-        if browser: await browser.close()
-        if playwright: await playwright.stop()
+    if all_options:
+        if buffer is not None:
+            buffer.set_doc("store_options", query_term.lower(), store_options_doc(query_term, all_options))
+        else:
+            save_store_options(query_term, all_options)
+        print(f"✅ [Store Options] Guardadas {len(all_options)} opciones para {query_term}")
+    else:
+        print(f"⚠️ [Store Options] No se encontraron opciones para {query_term}")
 
-async def scrape_store_options(query_term: str, limit: int = 10):
+@metrics.timed("scrape_job_seconds", scope="query")
+async def scrape_and_cache(query_term: str, options_limit: int = 10):
     """
-    Scrapes múltiples opciones de comparación para cada tienda y las guarda en Firestore.
-    Se ejecuta en GitHub Actions para pre-cargar opciones sin necesidad de backend.
+    Versión silenciosa de scrape_stream para el background worker.
+    Un solo crawl por tienda alimenta cached_results (ganador) y store_options (top-N).
+    Usa el pool compartido; quien orquesta la corrida debe llamar a browser_pool.close().
     """
-    print(f"🔍 [Store Options] Scraping opciones para: {query_term}")
-    playwright = None
-    browser = None
+    print(f"🔄 [Background] Actualizando: {query_term}")
     try:
-        playwright = await async_playwright().start()
-        browser = await playwright.chromium.launch(
-            headless=True, 
-            args=["--disable-blink-features=AutomationControlled"]
-        )
-        
+        # Snapshot anterior (sin importar su edad) para las alertas de baja de precio
+        previous = await get_cached_results_async(query_term, max_age_hours=24 * 365)
+        results_for_cache = []
         all_options = []
         for store in STORES:
             try:
-                print(f"  📦 Buscando en {store['name']}...")
-                options = await collect_store_options(browser, store, query_term, limit)
+                result, options = await scrape_store_once(store, query_term, options_limit)
+                if result and result['status'] == 'success':
+                    results_for_cache.append(result)
                 all_options.extend(options)
-                print(f"  ✅ Encontradas {len(options)} opciones en {store['name']}")
             except Exception as e:
-                print(f"  ❌ Error en {store['name']}: {e}")
-
-        if all_options and db:
-            # Guardar en Firestore: store_options/{query_term_lowercase}
-            doc_ref = db.collection("store_options").document(query_term.lower())
-            doc_ref.set({
-                "query_term": query_term.lower(),
-                "updated_at": datetime.now().isoformat(),
-                "options": all_options,
-                "total_options": len(all_options)
-            })
-            print(f"✅ [Store Options] Guardadas {len(all_options)} opciones para {query_term}")
-        else:
-            print(f"⚠️ [Store Options] No se encontraron opciones para {query_term}")
+                print(f"❌ [Background] Error en {store['name']} para {query_term}: {e}")
+
+        await persist_scrape_async(query_term, results_for_cache, all_options)
+        # Una pasada por query: solo si bajó el precio se leen y notifican sus suscriptores
+        await firestore_io.call(run_alerts, db, [(query_term, previous, results_for_cache)], op="alerts", timeout=60, default={})
 
     except Exception as e:
-        print(f"💥 [Store Options] Error crítico para {query_term}: {e}")
-    finally:
-        if browser: await browser.close()
-        if playwright: await playwright.stop()
+        print(f"💥 [Background] Error crítico para {query_term}: {e}")
 
 # ===== COMENTADO: Background task reemplazado por GitHub Actions =====
 # async def background_scraper_task():
@@ -175,10 +396,30 @@ async def scrape_store_options(query_term: str, limit: int = 10):
 #             print(f"💥 [Background] Error en el loop principal: {e}")
 #             await asyncio.sleep(60)
 
+async def warm_up():
+    """Inicialización en segundo plano del API; los endpoints igual la esperan si la necesitan."""
+    await ensure_firebase()
+    # start() lee el índice y registra listeners: también fuera del event loop
+    await firestore_io.call(products_snapshot.start, db, op="snapshot_start", timeout=None)
+    if TRACKED_INDEX_LISTENER:
+        await firestore_io.call(tracked_index_maintainer.start, db, op="index_start", timeout=None)
+    await ensure_chromium()
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Background task disabled - GitHub Actions handles scraping
+    # El arranque no espera a Firebase ni a Chromium: "/" responde de inmediato
+    warmup = asyncio.create_task(warm_up())
     yield
+    warmup.cancel()
+    tracked_index_maintainer.stop()
+    products_snapshot.stop()
+    await browser_pool.close()
+    await close_client()
+    listing_cache.close()
+    store_health.save()
+    selector_stats.save()
+    firestore_io.shutdown()
 
 app = FastAPI(title="price-hunter-backend", lifespan=lifespan)
 
@@ -205,64 +446,22 @@ def init_db():
     # Firestore no requiere inicialización de tablas
     pass
 
-def add_tracked_query_db(query_term: str):
-    if not db: return
-    try:
-        doc_ref = db.collection("tracked_queries").document(query_term.lower())
-        doc_ref.set({
-            "query_term": query_term.lower(),
-            "last_updated": None
-        }, merge=True)
-    except Exception as e:
-        print(f"Error adding tracked query: {e}")
-
-def remove_tracked_query_db(query_term: str):
-    if not db: return
-    try:
-        db.collection("tracked_queries").document(query_term.lower()).delete()
-    except Exception as e:
-        print(f"Error removing tracked query: {e}")
-
+@metrics.timed("firestore_op_seconds", op="tracked_queries")
 def get_tracked_queries_db():
     if not db: return []
     try:
-        # Busca en TODAS las subcolecciones 'tracking' de todos los usuarios
-        docs = db.collection_group('tracking').stream()
-        unique_queries = {}
-
-        for doc in docs:
-            data = doc.to_dict() or {}
-            q = data.get("query") or data.get("query_term") or doc.id
-            lu = data.get("last_updated")
-
-            # Normalizar last_updated a string ISO si viene como datetime/timestamp
-            try:
-                if isinstance(lu, datetime):
-                    lu = lu.isoformat()
-            except:
-                pass
-
-            if q:
-                # Si ya existe el query, conservar el timestamp más antiguo para forzar actualización
-                prev = unique_queries.get(q)
-                if not prev:
-                    unique_queries[q] = lu
-                else:
-                    try:
-                        if prev and lu:
-                            prev_dt = datetime.fromisoformat(prev) if isinstance(prev, str) else None
-                            lu_dt = datetime.fromisoformat(lu) if isinstance(lu, str) else None
-                            if prev_dt and lu_dt and lu_dt < prev_dt:
-                                unique_queries[q] = lu
-                    except:
-                        # Si no se puede comparar, mantener el existente
-                        pass
-
-        return [{"query": q, "last_updated": lu} for q, lu in unique_queries.items()]
+        # Índice agregado (una entrada por query), validado contra un count() de los trackings
+        if os.environ.get("TRACKED_INDEX_REBUILD") != "1":
+            entries = read_tracked_index(db)
+            if entries and not tracked_index_is_stale(db, entries):
+                return entries
+        # Índice vacío, desfasado o reconstrucción pedida: escaneo completo de users/*/tracking
+        return rebuild_tracked_index(db)
     except Exception as e:
-        print(f"Error getting tracked queries (collection_group): {e}")
+        print(f"Error getting tracked queries (index): {e}")
         return []
 
+@metrics.timed("firestore_op_seconds", op="touch_tracking")
 def update_tracked_query_timestamp(query_term: str):
     if not db: return
     try:
@@ -275,6 +474,7 @@ def update_tracked_query_timestamp(query_term: str):
     except Exception as e:
         print(f"Error updating timestamp (collection_group): {e}")
 
+@metrics.timed("firestore_op_seconds", op="get_cached_results")
 def get_cached_results(query_term: str, max_age_hours: int = 24) -> List[dict]:
     if not db: return []
     try:
@@ -303,48 +503,158 @@ def get_cached_results(query_term: str, max_age_hours: int = 24) -> List[dict]:
         print(f"Error getting cached results: {e}")
         return []
 
+# Capa en memoria delante de cached_results (clave = query normalizada)
+results_cache = TTLCache(
+    ttl_s=int(os.environ.get("RESULTS_CACHE_TTL", 600)),
+    max_entries=int(os.environ.get("RESULTS_CACHE_MAX_ENTRIES", 512)),
+    max_bytes=int(os.environ.get("RESULTS_CACHE_MAX_BYTES", 16 * 1024 * 1024)),
+)
+scrape_flights = SingleFlight()
+# Listados crudos por (tienda, query normalizada) dentro del TTL (listing_cache.py)
+listing_cache = ListingCache(
+    path=os.environ.get("LISTING_CACHE_PATH", LISTING_CACHE_DEFAULT_PATH),
+    ttl_s=float(os.environ.get("LISTING_CACHE_TTL", 20 * 60)),
+)
+
+# Latencias por tienda -> timeouts, hedge y circuit breaker (store_health.py)
+store_health = StoreHealth(os.environ.get("STORE_HEALTH_PATH", STORE_HEALTH_DEFAULT_PATH))
+HEDGE_ENABLED = os.environ.get("SCRAPE_HEDGE", "1") == "1"
+# Qué variante de selector acierta por tienda y campo (selector_stats.py)
+selector_stats = SelectorStats(os.environ.get("SELECTOR_STATS_PATH", SELECTOR_STATS_DEFAULT_PATH))
+
+def results_cache_key(query_term: str) -> str:
+    return normalize_text(query_term)
+
+def listing_is_cached(store, query_term: str) -> bool:
+    """El crawl de (tienda, query) saldría de listing_cache (el scheduler no le cobra el limitador)."""
+    return not fixtures.MODE and listing_cache.has(store, query_term)
+
+def flight_key(query_term: str, fresh: bool = False) -> str:
+    """Clave de scrape_flights; los force_refresh solo se unen entre sí (el otro puede venir del listing_cache)."""
+    return results_cache_key(query_term) + ("#fresh" if fresh else "")
+
+async def get_cached_results_fast(query_term: str) -> List[dict]:
+    """get_cached_results con LRU/TTL en memoria: los productos populares no tocan Firestore."""
+    key = results_cache_key(query_term)
+    cached = results_cache.get(key)
+    if cached is not None:
+        return cached
+    cached = await get_cached_results_async(query_term)
+    if cached:
+        results_cache.set(key, cached)
+    return cached
+
+def flatten_cached_doc(doc_id: str, data: dict) -> List[dict]:
+    """Aplana un documento de cached_results en filas (una por tienda)."""
+    query_term = data.get("query_term", doc_id).title()
+    updated_at = data.get("updated_at")
+    rows = []
+    for r in data.get("results", []):
+        rows.append({
+            "query_term": query_term,
+            "name": r.get("name"),
+            "store": r.get("store"),
+            "price": r.get("price"),
+            "status": r.get("status"),
+            "url": r.get("url"),
+            "updated_at": updated_at
+        })
+    return rows
+
+@metrics.timed("firestore_op_seconds", op="get_all_cached_products")
 def get_all_cached_products() -> List[dict]:
     if not db: return []
     try:
         results = []
         docs = db.collection("cached_results").stream()
         for doc in docs:
-            data = doc.to_dict()
-            query_term = data.get("query_term", doc.id).title()
-            updated_at = data.get("updated_at")
-            
-            for r in data.get("results", []):
-                results.append({
-                    "query_term": query_term,
-                    "name": r.get("name"),
-                    "store": r.get("store"),
-                    "price": r.get("price"),
-                    "status": r.get("status"),
-                    "url": r.get("url"),
-                    "updated_at": updated_at
-                })
+            results.extend(flatten_cached_doc(doc.id, doc.to_dict()))
         return results
     except Exception as e:
         print(f"Error getting all cached products: {e}")
         return []
 
+def flatten_and_validate(doc_id: str, data: dict) -> List[dict]:
+    """Filas validadas con ScrapeResult UNA vez al entrar al snapshot (no en cada request)."""
+    rows = []
+    for row in flatten_cached_doc(doc_id, data):
+        try:
+            validated = ScrapeResult(**row).model_dump()
+            validated["updated_at"] = row["updated_at"]
+            rows.append(validated)
+        except Exception as e:
+            print(f"⚠️ [Snapshot] Fila inválida en {doc_id}: {e}")
+    return rows
+
+products_snapshot = ProductsSnapshot(flatten_and_validate)
+tracked_index_maintainer = TrackedIndexMaintainer()
+# Listener del índice solo en instancias siempre encendidas (ver tracked_index.py)
+TRACKED_INDEX_LISTENER = os.environ.get("TRACKED_INDEX_LISTENER") == "1"
+
+def cached_results_doc(query_term: str, results: List[dict]) -> dict:
+    return {
+        "query_term": query_term.lower(),
+        "updated_at": datetime.now().isoformat(),
+        "results": results,
+        "content_hash": content_hash(results)
+    }
+
+def store_options_doc(query_term: str, options: List[dict]) -> dict:
+    return {
+        "query_term": query_term.lower(),
+        "updated_at": datetime.now().isoformat(),
+        "options": options,
+        "total_options": len(options),
+        "content_hash": content_hash(options)
+    }
+
+@metrics.timed("firestore_op_seconds", op="save_results")
 def save_results_to_cache(query_term: str, results: List[dict]):
     if not db: return
     try:
         doc_ref = db.collection("cached_results").document(query_term.lower())
-        doc_ref.set({
-            "query_term": query_term.lower(),
-            "updated_at": datetime.now().isoformat(),
-            "results": results
-        })
+        doc_ref.set(cached_results_doc(query_term, results))
     except Exception as e:
         print(f"Error saving results to cache: {e}")
 
+@metrics.timed("firestore_op_seconds", op="save_store_options")
+def save_store_options(query_term: str, options: List[dict]):
+    if not db: return
+    try:
+        # Guardar en Firestore: store_options/{query_term_lowercase}
+        doc_ref = db.collection("store_options").document(query_term.lower())
+        doc_ref.set(store_options_doc(query_term, options))
+    except Exception as e:
+        print(f"Error saving store options: {e}")
+
+# --- ACCESO ASÍNCRONO A FIRESTORE ---
+# Lo que corre dentro de corutinas (endpoints, SSE, scrape_and_cache) pasa por aquí:
+# la llamada síncrona del SDK va a un hilo del pool de firestore_io, con timeout.
+async def get_cached_results_async(query_term: str, max_age_hours: int = 24) -> List[dict]:
+    return await firestore_io.call(get_cached_results, query_term, max_age_hours, op="get_cached_results", default=[])
+
+async def save_results_to_cache_async(query_term: str, results: List[dict]):
+    await firestore_io.call(save_results_to_cache, query_term, results, op="save_results")
+
+async def get_all_cached_products_async() -> List[dict]:
+    return await firestore_io.call(get_all_cached_products, op="get_all_cached_products", default=[])
+
+async def get_tracked_queries_db_async() -> List[dict]:
+    # Reconstruir el índice puede tardar más que una lectura normal
+    return await firestore_io.call(get_tracked_queries_db, op="tracked_queries", timeout=120, default=[])
+
+async def persist_scrape_async(query_term: str, results_for_cache: List[dict], all_options: List[dict]):
+    await firestore_io.call(persist_scrape, query_term, results_for_cache, all_options, op="persist_scrape", timeout=60)
+
 # --- 2. CONFIGURACIÓN DE TIENDAS (SELECTORES MEJORADOS) ---
 STORES = [
     {
         "name": "Amazon México",
         "search_url": "https://www.amazon.com.mx/s?k={query}",
+        # Límites del scheduler (ver scheduler.DEFAULT_LIMITS). Amazon bloquea rápido.
+        "limits": {"rate_per_min": 12, "burst": 1, "concurrency": 1, "delay": 3.0},
+        # Política de red (ver network_policy.DEFAULT_POLICY). Los scripts de Amazon viven en su CDN.
+        "network": {"allow": ["*.media-amazon.com/*", "*.ssl-images-amazon.com/*"]},
         "selectors": {
             "item": [
                 # 1. Estándar
@@ -372,12 +682,17 @@ STORES = [
                 ".a-price .a-offscreen", 
                 "span.a-price span.a-offscreen",
                 ".a-price"
-            ]
+            ],
+            # Página de captcha ("Escribe los caracteres que ves"): bloqueo, no búsqueda vacía
+            "blocked": "form[action*='validateCaptcha']"
         }
     },
     {
         "name": "Mercado Libre",
         "search_url": "https://listado.mercadolibre.com.mx/{query}",
+        "static": True,  # listado en HTML del servidor: se intenta sin navegador
+        "limits": {"rate_per_min": 30, "burst": 2, "concurrency": 2, "delay": 1.0},
+        "network": {"allow": ["*.mlstatic.com/*"]},
         "selectors": {
             # Array para soportar diseño viejo y diseño nuevo "Poly"
             "item": ["div.ui-search-result__wrapper", "li.ui-search-layout__item", "div.poly-card"],
@@ -393,6 +708,8 @@ STORES = [
     {
         "name": "Cyberpuerta",
         "search_url": "https://www.cyberpuerta.mx/index.php?cl=search&searchparam={query}",
+        "static": True,
+        "limits": {"rate_per_min": 20, "burst": 2, "concurrency": 2, "delay": 1.5},
         "selectors": {
             "item": "div.emproduct", 
             "title": "a.emproduct_right_title",
@@ -404,6 +721,8 @@ STORES = [
     {
         "name": "DDtech",
         "search_url": "https://ddtech.mx/buscar/{query}",
+        "static": True,
+        "limits": {"rate_per_min": 20, "burst": 2, "concurrency": 2, "delay": 1.5},
         "selectors": {
             "item": "div.product",
             "title": "h3 a",
@@ -428,6 +747,11 @@ class ScrapeResult(BaseModel):
     url: str
     query_term: Optional[str] = None
 
+class BatchScrapeRequest(BaseModel):
+    queries: List[str]
+    force_refresh: bool = False
+    format: str = "ndjson"  # "ndjson" o "sse"
+
 class AnalysisRequest(BaseModel):
     productName: str
     priceHistory: List[dict] 
@@ -445,369 +769,527 @@ def clean_price(text_price: Optional[str]) -> float:
         match = re.search(r"(\d+(\.\d+)?)", clean)
         return float(match.group(1)) if match else 0.0
 
-async def apply_stealth_manual(page):
-    await page.add_init_script("""
+async def apply_stealth_manual(target):
+    """Oculta navigator.webdriver; `target` puede ser una página o un contexto completo."""
+    await target.add_init_script("""
         Object.defineProperty(navigator, 'webdriver', {
             get: () => undefined
         });
     """)
 
-def normalize_text(text: str) -> str:
+# Páginas abiertas a la vez en todo el proceso (alcanza para consultar todas las tiendas en paralelo)
+SEMAPHORE = asyncio.Semaphore(int(os.environ.get("SCRAPE_CONCURRENCY", len(STORES))))
+
+WINNER_DEPTH = 15   # items considerados para el ganador de cached_results
+OPTIONS_DEPTH = 20  # items considerados para store_options
+
+def _as_list(sel_conf) -> List[str]:
+    return sel_conf if isinstance(sel_conf, list) else [sel_conf]
+
+# --- MOTOR DE EXTRACCIÓN EN PÁGINA ---
+# Una sola llamada page.evaluate por página: prueba los selectores de item, título,
+# precio y link dentro del navegador y regresa todos los candidatos como JSON.
+EXTRACT_JS = """
+(spec) => {
+    const visible = (el) => !!(el && (el.offsetWidth || el.offsetHeight || el.getClientRects().length));
+    // probes[campo][selector] = [aciertos, fallos] en el orden en que se probaron (ver selector_stats.py)
+    const probes = {item: {}, title: {}, price: {}, link: {}};
+    const tally = (field, sels, hitIndex) => {
+        const upto = hitIndex < 0 ? sels.length : hitIndex + 1;
+        for (let i = 0; i < upto; i++) {
+            const row = probes[field][sels[i]] || (probes[field][sels[i]] = [0, 0]);
+            row[i === hitIndex ? 0 : 1]++;
+        }
+    };
+
+    let selector = null;
+    let nodes = [];
+    let itemHit = -1;
+    for (let i = 0; i < spec.item.length; i++) {
+        const found = document.querySelectorAll(spec.item[i]);
+        if (found.length) { selector = spec.item[i]; nodes = Array.from(found); itemHit = i; break; }
+    }
+
+    // Sin CSS (política de red) la visibilidad no es confiable: el aviso solo cuenta si no hay items
+    if (!nodes.length && spec.no_results) {
+        const nr = document.querySelector(spec.no_results);
+        if (nr && visible(nr)) return {no_results: true, selector: null, total: 0, items: [], probes: probes};
+    }
+    tally("item", spec.item, itemHit);
+
+    const text = (el) => ((el.innerText || el.textContent || "") + "").trim();
+    const titleOf = (root) => {
+        for (let i = 0; i < spec.title.length; i++) {
+            const el = root.querySelector(spec.title[i]);
+            if (el) { tally("title", spec.title, i); return text(el); }
+        }
+        tally("title", spec.title, -1);
+        return "";
+    };
+    const priceOf = (root) => {
+        for (let i = 0; i < spec.price.length; i++) {
+            const el = root.querySelector(spec.price[i]);
+            if (!el) continue;
+            const t = text(el) || (el.textContent || "").trim();
+            if (t) { tally("price", spec.price, i); return t; }
+        }
+        tally("price", spec.price, -1);
+        return "";
+    };
+    const hrefOf = (root) => {
+        for (let i = 0; i < spec.link.length; i++) {
+            const el = root.querySelector(spec.link[i]);
+            if (el) { tally("link", spec.link, i); return el.href || el.getAttribute("href") || ""; }
+        }
+        tally("link", spec.link, -1);
+        return "";
+    };
+
+    const items = nodes.slice(0, spec.limit).map((n) => ({
+        title: titleOf(n),
+        price_text: priceOf(n),
+        href: hrefOf(n)
+    }));
+    return {no_results: false, selector: selector, total: nodes.length, items: items, probes: probes};
+}
+"""
+
+def extraction_spec(store, limit: int) -> dict:
+    """
+    Convierte los selectores de STORES en el spec que consume EXTRACT_JS.
+    Cada lista va en el orden aprendido (selector_stats): la de mejor tasa de acierto reciente primero.
+    """
+    sels = store["selectors"]
+    return {
+        "item": selector_stats.order(store["name"], "item", _as_list(sels["item"])),
+        "title": selector_stats.order(store["name"], "title", _as_list(sels["title"])),
+        "price": selector_stats.order(store["name"], "price", _as_list(sels["price"])),
+        "link": selector_stats.order(store["name"], "link", _as_list(sels["link"])),
+        "no_results": sels.get("no_results"),
+        "blocked": sels.get("blocked"),
+        "limit": limit,
+    }
+
+def build_candidates(store, query, raw_items: List[dict], base_url: str):
     """
-    Convierte 'RTX 5070TI' en 'rtx 5070 ti' para facilitar la búsqueda.
-    Separa números de letras y quita caracteres raros.
+    Matching (matching.py), limpieza de precio y normalización de links sobre el arreglo crudo.
+    Todos los títulos se puntúan en un solo lote. Regresa (candidatos rankeados, mensajes_de_log).
     """
-    if not text: return ""
-    # 1. A minúsculas
-    text = text.lower()
-    # 2. Separar números de letras (ej: 5070ti -> 5070 ti)
-    text = re.sub(r'(\d+)([a-z]+)', r'\1 \2', text)
-    text = re.sub(r'([a-z]+)(\d+)', r'\1 \2', text)
-    # 3. Quitar puntuación extra
-    text = re.sub(r'[^a-z0-9\s]', ' ', text)
-    # 4. Quitar espacios dobles
-    return " ".join(text.split())
+    logs = []
+    candidates = []
+    # Normalizamos la búsqueda del usuario (ej: "5070TI" -> "5070 ti")
+    compiled = compile_query(query)
+    logs.append(f"🔍 {store['name']}: Buscando tokens {set(compiled.tokens)} (obligatorios: {set(compiled.required) or '-'})...")
+
+    titles = [(raw.get("title") or "").strip() for raw in raw_items]
+    scores = score_batch(query, titles)
+
+    for i, (raw, title, (score, match_count, is_exact, is_partial)) in enumerate(zip(raw_items, titles, scores)):
+        if not title:
+            logs.append(f"   ⚠️ {store['name']}: Item {i} sin título detectable.")
+            continue
+
+        if not is_partial and not is_exact:
+            logs.append(f"   ❌ {store['name']}: Descartado '{title[:20]}...' (Match: {match_count}/{len(compiled)}, score {score})")
+            continue
+
+        final_price = clean_price(raw.get("price_text"))
+        if final_price > 500000: final_price /= 100
+        if final_price <= 50:
+            continue
+
+        link_href = raw.get("href") or ""
+        full_url = link_href
+        if link_href and not link_href.startswith("http"):
+            full_url = urljoin(base_url, link_href)
+
+        candidates.append({
+            "name": title,
+            "price": final_price,
+            "url": full_url,
+            "match_count": match_count,
+            "score": score,
+            "is_exact": is_exact,
+            "position": i
+        })
+        medal = "🥇" if is_exact else "🥈"
+        kind = "EXACTO" if is_exact else "PARCIAL"
+        logs.append(f"   {medal} {store['name']}: Candidato {kind} ${final_price} - {title[:30]}...")
 
-SEMAPHORE = asyncio.Semaphore(3)
+    return rank(candidates), logs
 
-async def search_store(browser, store, query):
-    async with SEMAPHORE:
-        context = await browser.new_context(
-            user_agent=random.choice(USER_AGENTS),
-            viewport={"width": 1920, "height": 1080},
-            locale="es-MX",
-            timezone_id="America/Mexico_City"
-        )
-        
+async def crawl_store(store, query, fresh: bool = False, cached: Optional[dict] = None):
+    """
+    Carga UNA vez la página de búsqueda de la tienda y extrae la lista de candidatos.
+    Es un generador: emite eventos 'log' y termina con un evento 'crawl':
+      {"type": "crawl", "status": "ok" | "not_found" | "error", "engine": "http" | "browser",
+       "url": ..., "candidates": [...], "timings": {...}}
+    Cada candidato: name, price, url, match_count, score, is_exact, position.
+    La lista viene rankeada (matching.rank); de ella salen ganador y opciones (pick_results).
+    `timings` trae los segundos por fase: cache, fetch (ruta estática), context, goto, wait, extract, match.
+    Un listado vigente en listing_cache (misma tienda y query normalizada) evita la red por completo,
+    salvo con fresh=True (force_refresh del usuario): entonces se descarga y se reemplaza.
+    `cached` = listado que el llamador ya leyó de listing_cache (crawl_store_resilient).
+    Las tiendas con "static": True se intentan primero con HTTP simple (static_fetch.py).
+    Con navegador, `network` trae requests/bloqueados/bytes según la política de la tienda (network_policy.py).
+    """
+    search_url = store["search_url"].format(query=query.replace(" ", "+"))
+    target_url = fixtures.resolve_search_url(store, query, search_url)
+    crawl = {"type": "crawl", "status": "error", "url": search_url, "candidates": [], "timings": {}}
+    timings = crawl["timings"]
+    mark = time.perf_counter()
+
+    def lap(phase):
+        nonlocal mark
+        now = time.perf_counter()
+        timings[phase] = round(now - mark, 4)
+        metrics.observe("scrape_phase_seconds", now - mark, phase=phase, store=store["name"])
+        mark = now
+
+    spec = extraction_spec(store, OPTIONS_DEPTH)
+
+    # Listado reciente de la misma (tienda, query normalizada): sin red. Fuera en modo fixtures.
+    if cached is None and not (fixtures.MODE or fresh):
+        cached = listing_cache.get(store, query)
+    if cached:
+        lap("cache")
+        crawl["engine"] = "cache"
+        if cached["status"] == "not_found":
+            crawl["status"] = "not_found"
+            yield crawl
+            return
+        yield {"type": "log", "message": f"💾 {store['name']}: Listado en caché ({cached['age_s']:.0f}s): {len(cached['items'])} items"}
+        candidates, logs = build_candidates(store, query, cached["items"], cached["url"] or search_url)
+        lap("match")
+        for message in logs:
+            yield {"type": "log", "message": message}
+        crawl["candidates"] = candidates
+        crawl["status"] = "ok"
+        yield crawl
+        return
+
+    # Ruta rápida sin navegador para tiendas con HTML del servidor
+    if store.get("static"):
+        extracted = await fetch_listing(target_url, spec, USER_AGENTS, keep_html=fixtures.MODE == "record")
+        lap("fetch")
+        if extracted and (extracted["items"] or extracted["no_results"]):
+            crawl["engine"] = "http"
+            selector_stats.record(store["name"], extracted.get("probes"))
+            # Modo record: el HTML del servidor es lo que esta ruta reproduce después
+            if fixtures.MODE == "record":
+                try:
+                    fixtures.record(store, query, search_url, extracted["html"])
+                except Exception as e:
+                    print(f"⚠️ No se pudo guardar fixture: {e}")
+            if not fixtures.MODE:
+                listing_cache.put(store, query, "not_found" if extracted["no_results"] else "ok",
+                                  extracted["items"], search_url, "http")
+            if extracted["no_results"]:
+                crawl["status"] = "not_found"
+                yield crawl
+                return
+            yield {"type": "log", "message": f"⚡ {store['name']}: Items crudos en HTML estático: {extracted['total']}"}
+            candidates, logs = build_candidates(store, query, extracted["items"], search_url)
+            lap("match")
+            for message in logs:
+                yield {"type": "log", "message": message}
+            crawl["candidates"] = candidates
+            crawl["status"] = "ok"
+            yield crawl
+            return
+        yield {"type": "log", "message": f"↪️ {store['name']}: HTML estático sin items, usando navegador..."}
+
+    crawl["engine"] = "browser"
+    guard = NetworkGuard(policy_for(store))
+    async with SEMAPHORE, browser_pool.lease(network=guard) as context:
         page = await context.new_page()
-        await apply_stealth_manual(page)
-        await page.route("**/*", lambda route: route.abort() if route.request.resource_type in ["image", "media", "font"] else route.continue_())
-
-        search_url = store["search_url"].format(query=query.replace(" ", "+"))
-        # Estructura base de respuesta (ahora incluirá 'candidates' para debug si quieres)
-        result = {
-            "name": query, 
-            "store": store["name"], 
-            "price": 0.0, 
-            "status": "error", 
-            "url": search_url,
-            "query_term": query
-        }
+        lap("context")
 
         try:
-            await page.goto(search_url, timeout=60000, wait_until="domcontentloaded")
-
-            # --- DEBUG TEMPORAL: GUARDAR HTML SIEMPRE ---
-            # debug_dir = "debug_htmls"
-            # os.makedirs(debug_dir, exist_ok=True)
-            # timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            # safe_query = query.replace(" ", "_")
-            # safe_store = store["name"].replace(" ", "_")
-            # filename = f"{debug_dir}/{safe_store}_{safe_query}_{timestamp}.html"
-            
-            # try:
-            #     content = await page.content()
-            #     with open(filename, "w", encoding="utf-8") as f:
-            #         f.write(content)
-            #     print(f"📸 Snapshot guardado: {filename}")
-            # except Exception as e:
-            #     print(f"⚠️ No se pudo guardar snapshot: {e}")
-            # -------------------------------------------
-
-            # 1. Chequeo de "Sin resultados"
-            if "no_results" in store["selectors"]:
-                try:
-                    if await page.locator(store["selectors"]["no_results"]).count() > 0:
-                        if await page.locator(store["selectors"]["no_results"]).first.is_visible():
-                            result["status"] = "not_found"
-                            await context.close()
-                            yield {"type": "result", "data": result}
-                            return
-                except: pass
-
-            # 2. Determinar selector de items
-            item_selector = store["selectors"]["item"]
-            final_selector = None
-            
-            if isinstance(item_selector, list):
-                for sel in item_selector:
-                    count = await page.locator(sel).count()
-                    if count > 0:
-                        final_selector = sel
-                        break
-                if not final_selector: final_selector = item_selector[0]
-            else:
-                final_selector = item_selector
+            # Timeouts aprendidos del p95 de la tienda (60 s / 10 s mientras no hay muestras)
+            await page.goto(target_url, timeout=store_health.goto_timeout_ms(store["name"]), wait_until="domcontentloaded")
+            lap("goto")
+            store_health.record(store["name"], "goto", timings["goto"])
 
-            # Esperar a que carguen los items
+            # 1. Esperar a que aparezcan items (o el aviso de "Sin resultados")
+            ready_selector = ", ".join(spec["item"] + ([spec["no_results"]] if spec["no_results"] else []))
             try:
-                await page.wait_for_selector(final_selector, timeout=10000)
+                await page.wait_for_selector(ready_selector, timeout=store_health.wait_timeout_ms(store["name"]))
+                ready = True
             except:
-                result["status"] = "not_found"
-                await context.close()
-                yield {"type": "result", "data": result}
-                return
-
-            # --- ESTRATEGIA DE SELECCIÓN MÚLTIPLE ---
-            
-            # Obtener todos los elementos (limitamos a los primeros 15 para no saturar)
-            items = await page.locator(final_selector).all()
-            yield {"type": "log", "message": f"🕷️ {store['name']}: Items crudos encontrados en DOM: {len(items)}"}
-            
-            candidates = []
-
-            # --- PREPARACIÓN INTELIGENTE ---
-            # Normalizamos la búsqueda del usuario (ej: "5070TI" -> "5070 ti")
-            normalized_query = normalize_text(query)
-            query_tokens = set(normalized_query.split()) # Usamos set para búsqueda rápida
-            
-            yield {"type": "log", "message": f"🔍 {store['name']}: Buscando tokens {query_tokens}..."}
+                ready = False
+            lap("wait")
+            if ready:
+                store_health.record(store["name"], "wait", timings["wait"])
 
-            exact_matches = []
-            partial_matches = []
-
-            for i, item in enumerate(items[:15]):
+            # Modo record: guardar el DOM renderado para reproducirlo offline (ver fixtures.py)
+            if fixtures.MODE == "record":
                 try:
-                    # 1. Extraer Título
-                    title = ""
-                    title_sel_conf = store["selectors"]["title"]
-                    title_sels = title_sel_conf if isinstance(title_sel_conf, list) else [title_sel_conf]
-                    for ts in title_sels:
-                        if await item.locator(ts).count() > 0:
-                            title = await item.locator(ts).first.inner_text()
-                            break
-                    
-                    if not title:
-                        yield {"type": "log", "message": f"   ⚠️ {store['name']}: Item {i} sin título detectable."}
-                        continue
-
-                    # 2. Normalizar Título del Producto
-                    normalized_title = normalize_text(title)
-                    title_tokens = set(normalized_title.split())
-
-                    # 3. COMPARACIÓN DE TOKENS (Matemática de conjuntos)
-                    # ¿Cuántas palabras de la query están en el título?
-                    # intersection recupera las palabras que existen en ambos lados
-                    common_tokens = query_tokens.intersection(title_tokens)
-                    match_count = len(common_tokens)
-                    total_required = len(query_tokens)
-
-                    # Umbral de aceptación:
-                    # Aceptamos si coinciden TODAS las palabras (Exacto)
-                    # O si falta máximo 1 palabra (Parcial) - Útil si "GeForce" no aparece o cosas así
-                    is_exact = match_count == total_required
-                    is_partial = match_count >= (total_required - 1) and total_required > 1
-
-                    if not is_partial and not is_exact:
-                        yield {"type": "log", "message": f"   ❌ {store['name']}: Descartado '{title[:20]}...' (Match: {match_count}/{total_required})"}
-                        continue
-
-                    # 4. Extraer Precio (Tu lógica existente)
-                    price_text = ""
-                    price_sel_conf = store["selectors"]["price"]
-                    price_sels = price_sel_conf if isinstance(price_sel_conf, list) else [price_sel_conf]
-                    for ps in price_sels:
-                        if await item.locator(ps).count() > 0:
-                            price_text = await item.locator(ps).first.inner_text()
-                            if not price_text.strip(): price_text = await item.locator(ps).first.text_content()
-                            if price_text.strip(): break
-                    
-                    final_price = clean_price(price_text)
-                    if final_price > 500000: final_price /= 100
-                    
-                    if final_price > 50:
-                        # 5. Link
-                        link_href = ""
-                        link_sel_conf = store["selectors"]["link"]
-                        link_sels = link_sel_conf if isinstance(link_sel_conf, list) else [link_sel_conf]
-                        for ls in link_sels:
-                            if await item.locator(ls).count() > 0:
-                                link_href = await item.locator(ls).first.get_attribute("href")
-                                break
-                        
-                        full_url = link_href
-                        if link_href and not link_href.startswith("http"):
-                             base = "https://www.amazon.com.mx" if "amazon" in store["search_url"] else "https://www.cyberpuerta.mx"
-                             full_url = urljoin(base, link_href)
-
-                        candidate = {
-                            "name": title.strip(),
-                            "price": final_price,
-                            "url": full_url,
-                            "score": match_count
-                        }
-
-                        if is_exact:
-                            exact_matches.append(candidate)
-                            yield {"type": "log", "message": f"   🥇 {store['name']}: Candidato EXACTO ${final_price} - {title[:30]}..."}
-                        else:
-                            partial_matches.append(candidate)
-                            yield {"type": "log", "message": f"   🥈 {store['name']}: Candidato PARCIAL ${final_price} - {title[:30]}..."}
-
+                    fixtures.record(store, query, search_url, await page.content())
                 except Exception as e:
-                    continue
-
-            # --- SELECCIÓN DEL GANADOR ---
-            winner = None
-            if exact_matches:
-                exact_matches.sort(key=lambda x: x["price"])
-                winner = exact_matches[0]
-                result["status"] = "success"
-                result["match_type"] = "exact"
-            elif partial_matches:
-                partial_matches.sort(key=lambda x: x["price"])
-                winner = partial_matches[0]
-                result["status"] = "success" # O "warning"
-                result["match_type"] = "partial"
-            
-            if winner:
-                result["name"] = winner["name"]
-                result["price"] = winner["price"]
-                result["url"] = winner["url"]
-            else:
-                result["status"] = "not_found"
+                    print(f"⚠️ No se pudo guardar fixture: {e}")
+
+            if not ready:
+                if await is_blocked(page, spec):
+                    crawl["status"] = "error"
+                    crawl["blocked"] = True
+                    crawl["error"] = "blocked"
+                    yield {"type": "log", "message": f"🤖 {store['name']}: Captcha / bloqueo anti-bot en vez del listado."}
+                else:
+                    crawl["status"] = "not_found"
+                    crawl["timed_out"] = True
+                yield crawl
+                return
 
-        except Exception as e:
-            result["status"] = "error"
-            result["error"] = str(e)
-
-        await context.close()
-        yield {"type": "result", "data": result}
-
-async def collect_store_options(browser, store, query: str, limit: int = 5) -> List[dict]:
-    context = await browser.new_context(
-        user_agent=random.choice(USER_AGENTS),
-        viewport={"width": 1920, "height": 1080},
-        locale="es-MX",
-        timezone_id="America/Mexico_City",
-    )
-    page = await context.new_page()
-    await apply_stealth_manual(page)
-    await page.route("**/*", lambda route: route.abort() if route.request.resource_type in ["image", "media", "font"] else route.continue_())
+            # 2. Extracción masiva en una sola llamada:
+            #    {"no_results", "selector", "total", "items": [{title, price_text, href}]}
+            extracted = await page.evaluate(EXTRACT_JS, spec)
+            lap("extract")
+            selector_stats.record(store["name"], extracted.get("probes"))
+            if not fixtures.MODE:
+                listing_cache.put(store, query, "ok" if extracted["items"] and not extracted["no_results"] else "not_found",
+                                  extracted["items"], page.url or search_url, "browser")
+            if extracted["no_results"] or not extracted["items"]:
+                crawl["status"] = "not_found"
+                yield crawl
+                return
 
-    search_url = store["search_url"].format(query=query.replace(" ", "+"))
-    options: List[dict] = []
+            yield {"type": "log", "message": f"🕷️ {store['name']}: Items crudos encontrados en DOM: {extracted['total']}"}
 
-    try:
-        await page.goto(search_url, timeout=60000, wait_until="domcontentloaded")
+            # 3. Matching y ranking en Python
+            candidates, logs = build_candidates(store, query, extracted["items"], page.url or search_url)
+            lap("match")
+            for message in logs:
+                yield {"type": "log", "message": message}
+            crawl["candidates"] = candidates
+            crawl["status"] = "ok"
 
-        # no-results early exit
-        if "no_results" in store["selectors"]:
-            try:
-                if await page.locator(store["selectors"]["no_results"]).count() > 0 and await page.locator(store["selectors"]["no_results"]).first.is_visible():
-                    await context.close()
-                    return []
-            except:
-                pass
+        except Exception as e:
+            crawl["status"] = "error"
+            crawl["error"] = str(e)
+        finally:
+            crawl["network"] = await guard.measure(page)
 
-        # Determine item selector
-        item_selector = store["selectors"]["item"]
-        final_selector = None
-        if isinstance(item_selector, list):
-            for sel in item_selector:
-                if await page.locator(sel).count() > 0:
-                    final_selector = sel
-                    break
-            if not final_selector:
-                final_selector = item_selector[0]
-        else:
-            final_selector = item_selector
+    yield crawl
 
+async def is_blocked(page, spec) -> bool:
+    """La página es un captcha o un muro anti-bot (selector "blocked" de la tienda o "captcha" en la URL)."""
+    if "captcha" in (page.url or "").lower():
+        return True
+    if not spec["blocked"]:
+        return False
+    try:
+        return await page.query_selector(spec["blocked"]) is not None
+    except Exception:
+        return False
+
+def crawl_outcome(store, crawl) -> Optional[bool]:
+    """True = la tienda respondió bien, False = falla para el breaker, None = no concluyente."""
+    if crawl["status"] == "error":
+        return False
+    if crawl.get("timed_out"):
+        # Sin selector de "sin resultados" un timeout puede ser una búsqueda vacía legítima
+        # (los timeouts seguidos sí cuentan, ver store_health.timeout)
+        return False if store["selectors"].get("no_results") else None
+    return True
+
+async def crawl_store_resilient(store, query, fresh: bool = False, paced: bool = False):
+    """
+    crawl_store con circuit breaker y hedge: si la tienda está "abierta" se omite
+    (status "skipped"); si el intento pasa del p95 de la tienda, o falla antes, se
+    lanza un segundo intento y gana el primero que responda bien. Los logs de ambos
+    intentos salen en vivo; el perdedor se cancela (su contexto vuelve al pool).
+    El segundo intento se cobra al limitador de la tienda (scheduler.limiter_for):
+    solo sale si hay un cupo libre en ese momento y respeta token y pausa de cortesía,
+    así una tienda con concurrency 1 nunca recibe dos páginas a la vez. El primer
+    intento también se cobra, salvo con paced=True (el scheduler ya lo hizo).
+    Un listado vigente en listing_cache se sirve sin cobrar nada: ni cupo, ni
+    pausa, ni hedge (no hay petición a la tienda).
+    """
+    name = store["name"]
+    if store_health.is_open(name):
+        yield {"type": "log", "message": f"🚧 {name}: Omitida (circuit breaker abierto tras fallas seguidas)."}
+        yield {"type": "crawl", "status": "skipped", "url": store["search_url"].format(query=query.replace(" ", "+")),
+               "candidates": [], "timings": {}, "error": "circuit_open"}
+        return
+
+    cached = None if fixtures.MODE or fresh else listing_cache.get(store, query)
+    if cached:
+        async for event in crawl_store(store, query, cached=cached):
+            yield event
+        return
+
+    queue: asyncio.Queue = asyncio.Queue()
+    limiter = limiter_for(store)
+
+    async def attempt(n):
         try:
-            await page.wait_for_selector(final_selector, timeout=10000)
-        except:
-            await context.close()
-            return []
-
-        items = await page.locator(final_selector).all()
-
-        normalized_query = normalize_text(query)
-        query_tokens = set(normalized_query.split())
-
-        for item in items[:20]:
+            if n:
+                await limiter.pace()
+            # fresh=True: listing_cache ya se consultó arriba, el crawl va a la red y lo reemplaza
+            async for event in crawl_store(store, query, fresh=True):
+                await queue.put((n, event))
+        except Exception as e:
+            await queue.put((n, {"type": "crawl", "status": "error", "url": "", "candidates": [], "timings": {}, "error": str(e)}))
+
+    def launch(n):
+        task = asyncio.create_task(attempt(n))
+        if n or not paced:
+            # El cupo vuelve al terminar la tarea, aunque se cancele antes de arrancar
+            # (un finally dentro de attempt no correría en ese caso)
+            task.add_done_callback(lambda _: limiter.release())
+        tasks.append(task)
+
+    hedge_after = store_health.hedge_after_s(name) if HEDGE_ENABLED and not fixtures.MODE else None
+    if not paced:
+        # Crawls fuera del scheduler (/scrape-stream, /scrape-batch): mismo cupo por dominio
+        await limiter.acquire()
+    tasks = []
+    launch(0)
+    start = time.perf_counter()
+    finished, final = 0, None
+    try:
+        while final is None:
+            timeout = None
+            if hedge_after is not None and len(tasks) == 1:
+                timeout = max(0.0, hedge_after - (time.perf_counter() - start))
             try:
-                # title
-                title = ""
-                title_sel_conf = store["selectors"]["title"]
-                title_sels = title_sel_conf if isinstance(title_sel_conf, list) else [title_sel_conf]
-                for ts in title_sels:
-                    if await item.locator(ts).count() > 0:
-                        title = await item.locator(ts).first.inner_text()
-                        break
-                if not title:
+                n, event = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                slow_after, hedge_after = hedge_after, None
+                if not await limiter.try_acquire_slot():
+                    yield {"type": "log", "message": f"⏳ {name}: Más lento que su p95 ({slow_after:.1f}s), sin cupo para un intento de respaldo."}
                     continue
+                yield {"type": "log", "message": f"⏳ {name}: Más lento que su p95 ({slow_after:.1f}s), lanzando intento de respaldo..."}
+                launch(1)
+                metrics.inc("scrape_hedges_total", store=name, reason="slow")
+                continue
+            if event["type"] != "crawl":
+                yield event if n == 0 else {**event, "message": f"🔁 {event.get('message', '')}"}
+                continue
+            finished += 1
+            if crawl_outcome(store, event) is not False or finished >= 2:
+                final = event
+            elif (len(tasks) == 1 and HEDGE_ENABLED and not fixtures.MODE and not event.get("blocked")
+                  and await limiter.try_acquire_slot()):
+                # Falló rápido: reintento tras la pausa de cortesía (cuenta como el intento de respaldo).
+                # Un captcha no se reintenta: otra página al momento solo empeora el bloqueo
+                yield {"type": "log", "message": f"🔁 {name}: Falló el primer intento, reintentando..."}
+                launch(1)
+                metrics.inc("scrape_hedges_total", store=name, reason="retry")
+            elif finished >= len(tasks):
+                final = event
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+    outcome = crawl_outcome(store, final)
+    if outcome is None and final.get("timed_out") and store_health.timeout(name):
+        # Timeouts seguidos sin selector de "sin resultados": probablemente un bloqueo
+        outcome = False
+    if outcome:
+        store_health.success(name)
+        if final.get("engine") != "cache":
+            store_health.record(name, "total", time.perf_counter() - start)
+    elif outcome is False and store_health.failure(name):
+        yield {"type": "log", "message": f"🚧 {name}: Demasiadas fallas seguidas, se omitirá en las siguientes búsquedas."}
+    yield final
+
+def pick_results(store, query, crawl, options_limit: int = 0):
+    """
+    Ganador y opciones en una sola pasada sobre el ranking del crawl (matching.select):
+    el ganador sale de los primeros WINNER_DEPTH items, las opciones del ranking completo.
+    """
+    result = {
+        "name": query, 
+        "store": store["name"], 
+        "price": 0.0, 
+        "status": "error", 
+        "url": crawl["url"],
+        "query_term": query
+    }
+    if crawl["status"] in ("error", "skipped"):
+        result["status"] = crawl["status"]
+        result["error"] = crawl.get("error", "")
+        return result, []
+
+    winner, ranked_options = select_ranked(crawl["candidates"], WINNER_DEPTH, options_limit)
+
+    if winner:
+        result["name"] = winner["name"]
+        result["price"] = winner["price"]
+        result["url"] = winner["url"]
+        result["status"] = "success"
+        result["match_type"] = "exact" if winner["is_exact"] else "partial"
+    else:
+        result["status"] = "not_found"
+
+    options = [{
+        "name": c["name"],
+        "price": c["price"],
+        "url": c["url"],
+        "store": store["name"],
+        "match_score": c["match_count"],
+        "score": c["score"],
+    } for c in ranked_options]
+    return result, options
+
+def pick_winner(store, query, crawl) -> dict:
+    """Solo el ganador (exactos primero, luego el más barato)."""
+    return pick_results(store, query, crawl)[0]
+
+async def search_store(store, query, options_limit: int = 0, fresh: bool = False, paced: bool = False):
+    """
+    Un solo crawl por (tienda, query). Emite logs, el evento 'result' con el ganador
+    y, si options_limit > 0, un evento 'options' con las opciones de comparación.
+    """
+    crawl = None
+    start = time.perf_counter()
+    async for event in crawl_store_resilient(store, query, fresh, paced):
+        if event["type"] == "crawl":
+            crawl = event
+        else:
+            yield event
 
-                normalized_title = normalize_text(title)
-                title_tokens = set(normalized_title.split())
-                common_tokens = query_tokens.intersection(title_tokens)
-                match_count = len(common_tokens)
-                total_required = len(query_tokens)
-
-                is_exact = match_count == total_required
-                is_partial = match_count >= (total_required - 1) and total_required > 1
-                if not is_partial and not is_exact:
-                    continue
+    result, options = pick_results(store, query, crawl, options_limit)
+    metrics.observe("scrape_job_seconds", time.perf_counter() - start, scope="store", store=store["name"])
+    metrics.inc("scrape_results_total", store=store["name"], status=result["status"], engine=crawl.get("engine") or "none")
+    yield {"type": "result", "data": result, "timings": crawl["timings"]}
+    if options_limit > 0:
+        yield {"type": "options", "data": options}
 
-                # price
-                price_text = ""
-                price_sel_conf = store["selectors"]["price"]
-                price_sels = price_sel_conf if isinstance(price_sel_conf, list) else [price_sel_conf]
-                for ps in price_sels:
-                    if await item.locator(ps).count() > 0:
-                        price_text = await item.locator(ps).first.inner_text()
-                        if not price_text.strip():
-                            price_text = await item.locator(ps).first.text_content()
-                        if price_text.strip():
-                            break
-                final_price = clean_price(price_text)
-                if final_price > 500000:
-                    final_price /= 100
-                if final_price <= 50:
-                    continue
+async def merge_streams(streams: dict):
+    """
+    Combina varios generadores async en uno solo y emite (clave, evento) en cuanto llegan.
+    Si un generador truena se emite (clave, {"type": "error", "message": ...}) y el resto sigue.
+    Al cerrar el generador combinado se cancelan los productores pendientes.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    finished = object()
 
-                # link
-                link_href = ""
-                link_sel_conf = store["selectors"]["link"]
-                link_sels = link_sel_conf if isinstance(link_sel_conf, list) else [link_sel_conf]
-                for ls in link_sels:
-                    if await item.locator(ls).count() > 0:
-                        link_href = await item.locator(ls).first.get_attribute("href")
-                        break
-                full_url = link_href
-                if link_href and not link_href.startswith("http"):
-                    base = "https://www.amazon.com.mx" if "amazon" in store["search_url"] else (
-                        "https://www.cyberpuerta.mx" if "cyberpuerta" in store["search_url"] else (
-                            "https://www.mercadolibre.com.mx" if "mercadolibre" in store["search_url"] else "https://ddtech.mx"
-                        )
-                    )
-                    full_url = urljoin(base, link_href)
-
-                options.append({
-                    "name": title.strip(),
-                    "price": final_price,
-                    "url": full_url,
-                    "store": store["name"],
-                    "match_score": match_count,
-                })
-            except Exception:
-                continue
+    async def pump(key, gen):
+        try:
+            async for event in gen:
+                await queue.put((key, event))
+        except Exception as e:
+            await queue.put((key, {"type": "error", "message": str(e)}))
+        finally:
+            await queue.put((key, finished))
 
-        # sort by price asc, then by match score desc
-        options.sort(key=lambda x: (x["price"], -x["match_score"]))
-        # de-duplicate by name+url
-        seen = set()
-        deduped = []
-        for opt in options:
-            key = (opt["name"], opt["url"])
-            if key in seen:
+    tasks = [asyncio.create_task(pump(key, gen)) for key, gen in streams.items()]
+    pending = len(tasks)
+    try:
+        while pending:
+            key, event = await queue.get()
+            if event is finished:
+                pending -= 1
                 continue
-            seen.add(key)
-            deduped.append(opt)
-        await context.close()
-        return deduped[:limit]
-    except Exception:
-        await context.close()
-        return []
+            yield key, event
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
 # --- ENDPOINTS ---
 
@@ -815,79 +1297,316 @@ async def collect_store_options(browser, store, query: str, limit: int = 5) -> L
 async def root():
     return {"status": "ok", "service": "price-hunter-backend", "cache_system": "DISABLED_FOR_DEBUG"}
 
+@app.get("/metrics", tags=["meta"])
+async def get_metrics():
+    """Histogramas de tiempos por fase/tienda y contadores en formato Prometheus."""
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/ready", tags=["meta"])
+async def ready():
+    """Readiness por componente (a diferencia de "/", que solo indica que el proceso vive)."""
+    components = {
+        **READINESS,
+        "products_snapshot": "ready" if products_snapshot.ready.is_set() else "pending",
+        "browser_pool": "ready" if browser_pool.started else "idle",
+    }
+    is_ready = READINESS["firebase"] == "ready" and READINESS["chromium"] == "ready"
+    return Response(
+        content=json.dumps({"ready": is_ready, "components": components}),
+        media_type="application/json",
+        status_code=200 if is_ready else 503,
+    )
+
 # --- NUEVO ENDPOINT CON STREAMING ---
+@app.get("/price-history")
+async def price_history(
+    product_name: str = Query(...),
+    days: int = Query(30, ge=1, le=365),
+    series: bool = False,
+):
+    """
+    Estadísticas del historial por tienda: min/max/promedio/percentiles por ventana
+    y "el más bajo en N días". Con series=true incluye los puntos en el formato
+    de AnalysisRequest.priceHistory ({date, price}).
+    """
+    await ensure_firebase()
+    store_names = [store["name"] for store in STORES]
+    data = await firestore_io.call(load_price_series, db, product_name, store_names, days, op="history_load", default={})
+    response = {"query_term": product_name.lower(), "days": days, "stores": {}}
+    for store_name, (t, p) in data.items():
+        entry = window_stats(t, p, windows=tuple(w for w in (7, 30, 90) if w <= days) or (days,))
+        if series:
+            entry["series"] = [
+                {"date": datetime.fromtimestamp(int(m) * 60).isoformat(), "price": float(v)}
+                for m, v in zip(t, p)
+            ]
+        response["stores"][store_name] = entry
+    return response
+
 @app.get("/products", response_model=List[ScrapeResult])
-async def get_products():
+async def get_products(
+    since: Optional[str] = Query(None, description="Solo filas con updated_at posterior (ISO)"),
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=5000),
+    if_none_match: Optional[str] = Header(None),
+):
     """
     Retorna todos los productos almacenados en la base de datos.
     Útil para restaurar el estado de la aplicación al recargar.
+    Se sirve desde el snapshot en memoria (listener de Firestore); soporta
+    since=<updated_at> para deltas, offset/limit y ETag/304.
+    """
+    await ensure_firebase()
+    if products_snapshot.ready.is_set():
+        body, etag, total = products_snapshot.query(since, offset, limit)
+    else:
+        # Sin listener (arranque o sin Firebase): lectura directa como antes
+        body, etag, total = render_rows(await get_all_cached_products_async(), since, offset, limit)
+
+    headers = {"ETag": etag, "X-Total-Count": str(total), "Cache-Control": "no-cache"}
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+async def live_scrape_events(product_name: str, fresh: bool = False):
+    """
+    Scrape en vivo de todas las tiendas como eventos dict (log/result).
+    Lo comparten todos los suscriptores de la misma query vía scrape_flights
+    (/scrape-stream y /scrape-batch). Además de los 'result' exitosos que ve el
+    frontend, emite un 'store_result' por tienda con cualquier status (para el
+    resumen de /scrape-batch; /scrape-stream no lo reenvía).
     """
-    products = get_all_cached_products()
-    return [ScrapeResult(**p) for p in products]
+    yield {'type': 'log', 'message': '🕷️ Iniciando navegador...'}
+
+    results_for_cache = []
+    for store in STORES:
+        yield {'type': 'log', 'message': f"🔎 Consultando {store['name']}..."}
+
+    # Todas las tiendas en paralelo; los eventos salen en cuanto llegan
+    streams = {store['name']: search_store(store, product_name, fresh=fresh) for store in STORES}
+    async for store_name, event in merge_streams(streams):
+        if event["type"] == "log":
+            yield event
+        elif event["type"] == "error":
+            yield {'type': 'log', 'message': f"💥 Error {store_name}: {event['message']}"}
+            yield {'type': 'store_result', 'data': {"name": product_name, "store": store_name, "price": 0.0, "status": "error",
+                                                    "url": "", "query_term": product_name, "error": event['message']}}
+        elif event["type"] == "result":
+            result = event["data"]
+            yield {'type': 'store_result', 'data': result}
+            if result['status'] == 'success':
+                mt = "EXACTO" if result.get('match_type') == 'exact' else "PARCIAL"
+                yield {'type': 'log', 'message': f"🎉 {store_name}: {mt} ${result['price']:,.2f}"}
+                yield {'type': 'result', 'data': result}
+                results_for_cache.append(result)
+            elif result['status'] == 'not_found':
+                yield {'type': 'log', 'message': f"⚠️ {store_name}: Sin resultados."}
+            elif result['status'] == 'skipped':
+                yield {'type': 'log', 'message': f"🚧 {store_name}: Omitida temporalmente (demasiadas fallas seguidas)."}
+
+    if results_for_cache:
+        await save_results_to_cache_async(product_name, results_for_cache)
+        results_cache.set(results_cache_key(product_name), results_for_cache)
 
 @app.get("/scrape-stream")
 async def scrape_stream(product_name: str = Query(...), force_refresh: bool = False):
     async def event_generator():
-        playwright = None
-        browser = None
         try:
             yield f"data: {json.dumps({'type': 'log', 'message': f'🚀 Iniciando búsqueda: {product_name}'})}\n\n"
 
+            await ensure_firebase()
             if not force_refresh:
-                cached = get_cached_results(product_name)
+                cached = await get_cached_results_fast(product_name)
                 if cached:
                     yield f"data: {json.dumps({'type': 'log', 'message': f'✅ Caché: {len(cached)} items.'})}\n\n"
                     for prod in cached:
-                        prod['query_term'] = product_name
+                        prod = {**prod, 'query_term': product_name}
                         yield f"data: {json.dumps({'type': 'result', 'data': prod})}\n\n"
                     yield f"data: {json.dumps({'type': 'done', 'message': 'Fin por caché'})}\n\n"
                     return
 
-            yield f"data: {json.dumps({'type': 'log', 'message': '🕷️ Iniciando navegador...'})}\n\n"
-            
-            playwright = await async_playwright().start()
-            browser = await playwright.chromium.launch(
-                headless=True, 
-                args=["--disable-blink-features=AutomationControlled"]
-            )
-            
-            results_for_cache = []
-            for store in STORES:
-                store_name = store['name']
-                msg = f"🔎 Consultando {store_name}..."
-                yield f"data: {json.dumps({'type': 'log', 'message': msg})}\n\n"
-                try:
-                    async for event in search_store(browser, store, product_name):
-                        if event["type"] == "log":
-                            yield f"data: {json.dumps(event)}\n\n"
-                        elif event["type"] == "result":
-                            result = event["data"]
-                            if result['status'] == 'success':
-                                mt = "EXACTO" if result.get('match_type') == 'exact' else "PARCIAL"
-                                msg = f"🎉 {store_name}: {mt} ${result['price']:,.2f}"
-                                yield f"data: {json.dumps({'type': 'log', 'message': msg})}\n\n"
-                                yield f"data: {json.dumps({'type': 'result', 'data': result})}\n\n"
-                                results_for_cache.append(result)
-                            elif result['status'] == 'not_found':
-                                msg = f"⚠️ {store_name}: Sin resultados."
-                                yield f"data: {json.dumps({'type': 'log', 'message': msg})}\n\n"
-                except Exception as e:
-                     msg = f"💥 Error {store_name}: {e}"
-                     yield f"data: {json.dumps({'type': 'log', 'message': msg})}\n\n"
-
-            if results_for_cache:
-                save_results_to_cache(product_name, results_for_cache)
+            # Misses concurrentes de la misma query (también desde /scrape-batch) comparten un solo scrape
+            key = flight_key(product_name, force_refresh)
+            if scrape_flights.in_flight(key):
+                yield f"data: {json.dumps({'type': 'log', 'message': '🤝 Uniéndose a una búsqueda en curso...'})}\n\n"
+            async for event in scrape_flights.stream(key, lambda: live_scrape_events(product_name, fresh=force_refresh)):
+                if event["type"] != "store_result":
+                    yield f"data: {json.dumps(event)}\n\n"
             
             yield f"data: {json.dumps({'type': 'done', 'message': 'Proceso terminado'})}\n\n"
 
         except Exception as e:
             yield f"data: {json.dumps({'type': 'log', 'message': f'Error crítico: {e}'})}\n\n"
-        finally:
-            if browser: await browser.close()
-            if playwright: await playwright.stop()
 
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
+MAX_BATCH_QUERIES = int(os.environ.get("MAX_BATCH_QUERIES", 50))
+# Queries del lote scrapeándose a la vez; el ritmo por tienda lo ponen los limitadores del proceso
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_SCRAPE_CONCURRENCY", 4))
+
+async def batch_scrape_events(queries: List[str], force_refresh: bool = False):
+    """
+    Eventos de /scrape-batch, todos etiquetados con su query:
+      {"type": "result", "query", "source": "cache" | "live", "data"}
+      {"type": "query_done", "query", "found", "source"}
+      {"type": "summary", ...} al final.
+    Los hits de caché salen de inmediato; cada miss pasa por scrape_flights igual que
+    /scrape-stream (un lote y un stream de la misma query comparten el scrape) y sus
+    tiendas se cobran a los limitadores por dominio del proceso (scheduler.limiter_for),
+    así varios lotes y streams a la vez no multiplican el ritmo contra cada tienda.
+    """
+    start = time.perf_counter()
+    summary = {"queries": len(queries), "cached": 0, "scraped": 0, "results": 0,
+               "not_found": 0, "errors": 0, "skipped": 0}
+
+    # Firebase antes de scrapear: persist_scrape lo necesita también con force_refresh
+    await ensure_firebase()
+
+    # 1. Caché (en memoria / cached_results) para todas las queries a la vez
+    misses = list(queries)
+    if not force_refresh:
+        cached_lists = await asyncio.gather(*(get_cached_results_fast(q) for q in queries))
+        misses = []
+        for query, cached in zip(queries, cached_lists):
+            if not cached:
+                misses.append(query)
+                continue
+            summary["cached"] += 1
+            for prod in cached:
+                summary["results"] += 1
+                yield {"type": "result", "query": query, "source": "cache", "data": {**prod, "query_term": query}}
+            yield {"type": "query_done", "query": query, "found": len(cached), "source": "cache"}
+
+    if not misses:
+        summary["elapsed_s"] = round(time.perf_counter() - start, 2)
+        yield {"type": "summary", **summary}
+        return
+
+    # 2. Misses: una búsqueda compartida por query; los resultados salen por tienda conforme llegan
+    queue: asyncio.Queue = asyncio.Queue()
+    per_store = {}
+    slots = asyncio.Semaphore(max(1, BATCH_CONCURRENCY))
+
+    async def run_query(query):
+        found = 0
+        async with slots:
+            key = flight_key(query, force_refresh)
+            async for event in scrape_flights.stream(key, lambda: live_scrape_events(query, fresh=force_refresh)):
+                if event["type"] != "store_result":
+                    continue
+                result = {**event["data"], "query_term": query}
+                found += result["status"] == "success"
+                await queue.put({"type": "result", "query": query, "source": "live", "data": result})
+        await queue.put({"type": "query_done", "query": query, "found": found, "source": "live"})
+
+    summary["scraped"] = len(misses)
+    yield {"type": "log", "message": f"🔄 {len(misses)} queries sin caché -> {len(misses) * len(STORES)} búsquedas (query, tienda)"}
+
+    done = object()
+    runner = asyncio.ensure_future(asyncio.gather(*(run_query(q) for q in misses)))
+    runner.add_done_callback(lambda _: queue.put_nowait(done))
+    try:
+        while True:
+            event = await queue.get()
+            if event is done:
+                break
+            if event["type"] == "result":
+                status = event["data"]["status"]
+                store_stats = per_store.setdefault(event["data"]["store"], {"ok": 0, "failed": 0})
+                store_stats["ok" if status in ("success", "not_found") else "failed"] += 1
+                if status == "success":
+                    summary["results"] += 1
+                elif status == "not_found":
+                    summary["not_found"] += 1
+                elif status == "skipped":
+                    summary["skipped"] += 1
+                else:
+                    summary["errors"] += 1
+            yield event
+    finally:
+        # Cliente desconectado: deja de esperar (el scrape compartido termina y llena la caché)
+        if not runner.done():
+            runner.cancel()
+            await asyncio.gather(runner, return_exceptions=True)
+
+    elapsed = time.perf_counter() - start
+    summary["elapsed_s"] = round(elapsed, 2)
+    jobs = sum(s["ok"] + s["failed"] for s in per_store.values())
+    summary["jobs_per_min"] = round(jobs / (elapsed / 60), 2) if elapsed > 0 else 0.0
+    summary["per_store"] = per_store
+    yield {"type": "summary", **summary}
+
+@app.post("/scrape-batch")
+async def scrape_batch(req: BatchScrapeRequest):
+    """
+    Refresca una lista de productos en una sola conexión (NDJSON por defecto, o SSE).
+    Ver batch_scrape_events para el formato de los eventos.
+    """
+    # Dedup por query normalizada, respetando el orden de llegada
+    queries, seen = [], set()
+    for q in (q.strip() for q in req.queries):
+        key = results_cache_key(q)
+        if q and key not in seen:
+            seen.add(key)
+            queries.append(q)
+    if not queries:
+        raise HTTPException(status_code=400, detail="Se requiere al menos una query")
+    if len(queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"Máximo {MAX_BATCH_QUERIES} queries por lote")
+    if req.format not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="format debe ser 'ndjson' o 'sse'")
+
+    async def body():
+        try:
+            async for event in batch_scrape_events(queries, req.force_refresh):
+                line = json.dumps(event, ensure_ascii=False)
+                yield f"data: {line}\n\n" if req.format == "sse" else line + "\n"
+        except Exception as e:
+            error = json.dumps({"type": "error", "message": f"Error crítico: {e}"})
+            yield f"data: {error}\n\n" if req.format == "sse" else error + "\n"
+
+    media_type = "text/event-stream" if req.format == "sse" else "application/x-ndjson"
+    return StreamingResponse(body(), media_type=media_type)
+
+@app.get("/export")
+async def export_dump(
+    collections: str = Query(",".join(export.COLLECTIONS), description="cached_results,store_options"),
+    page_size: int = Query(export.PAGE_SIZE, ge=1, le=1000),
+):
+    """
+    Dump completo en NDJSON (una fila por resultado/opción), leído página por
+    página: la memoria no crece con el catálogo. Para Parquet usar export.py.
+    """
+    names = [c for c in collections.split(",") if c]
+    unknown = set(names) - set(export.COLLECTIONS)
+    if not names or unknown:
+        raise HTTPException(status_code=400, detail=f"collections debe ser un subconjunto de {', '.join(export.COLLECTIONS)}")
+    await ensure_firebase()
+    if not db:
+        raise HTTPException(status_code=503, detail="Firebase no disponible")
+
+    async def body():
+        for collection in names:
+            after_id = None
+            while True:
+                docs = await firestore_io.call(export.fetch_page, db, collection, after_id, page_size, op="export_page", default=None)
+                if docs is None:
+                    yield json.dumps({"type": "error", "message": f"Export interrumpido en {collection}"}) + "\n"
+                    return
+                for doc in docs:
+                    rows = export.flatten(collection, doc.id, doc.to_dict() or {})
+                    if rows:
+                        yield "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+                if len(docs) < page_size:
+                    break
+                after_id = docs[-1].id
+
+    return StreamingResponse(
+        body(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="export.ndjson"'},
+    )
+
 # ===== ENDPOINTS OBSOLETOS - Comentados porque no se usan =====
 # Frontend usa Firestore directamente, no estos endpoints
 
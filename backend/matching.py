@@ -0,0 +1,127 @@
+"""
+Motor de matching: normaliza títulos, puntúa candidatos y arma el ranking.
+
+La query se compila una vez (compile_query, con caché): tokens normalizados, peso
+por token y tokens obligatorios. Los números de modelo ("5070", "7800") y los
+sufijos de variante ("ti", "super", "xt"...) son obligatorios: un título sin ellos
+nunca cuenta, ni como parcial. Un título que trae una variante que la query no
+pidió ("5070 ti" buscando "5070") baja de exacto a parcial.
+
+score_batch() puntúa una lista de títulos de una vez (de una tienda o de varias)
+y rank() ordena los candidatos: exactos primero, luego precio, luego puntaje.
+Del mismo ranking salen el ganador y las opciones (select()).
+"""
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+_DIGIT_ALPHA = re.compile(r"(\d+)([a-z]+)")
+_ALPHA_DIGIT = re.compile(r"([a-z]+)(\d+)")
+_NON_ALNUM = re.compile(r"[^a-z0-9\s]")
+
+# Sufijos que distinguen productos distintos con el mismo número de modelo. Los de
+# ensambladora ("oc", "pro", "plus" en "MSI RTX 5070 OC", "Gaming Pro") no van: casi
+# todas las tarjetas los traen y degradarlas a parcial dejaría ganar a una laptop cara
+VARIANT_TOKENS = frozenset({"ti", "super", "xt", "xtx", "gre", "max", "ultra", "mini", "lite"})
+STOPWORDS = frozenset({"de", "del", "la", "el", "los", "las", "y", "con", "para", "en"})
+
+MODEL_WEIGHT = 3.0
+VARIANT_WEIGHT = 2.0
+WORD_WEIGHT = 1.0
+PARTIAL_MIN_SCORE = 0.6   # cobertura ponderada mínima para un parcial
+VARIANT_PENALTY = 0.15    # por cada variante en el título que la query no pidió
+
+
+@lru_cache(maxsize=4096)
+def normalize_text(text: str) -> str:
+    """
+    Convierte 'RTX 5070TI' en 'rtx 5070 ti' para facilitar la búsqueda.
+    Separa números de letras y quita caracteres raros.
+    """
+    if not text:
+        return ""
+    text = text.lower()
+    text = _DIGIT_ALPHA.sub(r"\1 \2", text)
+    text = _ALPHA_DIGIT.sub(r"\1 \2", text)
+    text = _NON_ALNUM.sub(" ", text)
+    return " ".join(text.split())
+
+
+def _weight(token: str) -> float:
+    if any(ch.isdigit() for ch in token):
+        return MODEL_WEIGHT
+    if token in VARIANT_TOKENS:
+        return VARIANT_WEIGHT
+    return WORD_WEIGHT
+
+
+class CompiledQuery:
+    """Query normalizada una sola vez, con pesos y tokens obligatorios."""
+
+    def __init__(self, query: str):
+        tokens = normalize_text(query).split()
+        # Las palabras vacías solo estorban si hay algo más que buscar
+        meaningful = [t for t in tokens if t not in STOPWORDS] or tokens
+        self.query = query
+        self.tokens = frozenset(meaningful)
+        self.weights: Dict[str, float] = {t: _weight(t) for t in self.tokens}
+        self.required = frozenset(t for t, w in self.weights.items() if w > WORD_WEIGHT)
+        self.total_weight = sum(self.weights.values()) or 1.0
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def score(self, title: str) -> Tuple[float, int, bool, bool]:
+        """(score 0..1, match_count, is_exact, is_partial) de un título."""
+        title_tokens = set(normalize_text(title).split())
+        matched = self.tokens & title_tokens
+        match_count = len(matched)
+        if not self.required <= matched:
+            return 0.0, match_count, False, False
+        score = sum(self.weights[t] for t in matched) / self.total_weight
+        extra_variants = len((title_tokens & VARIANT_TOKENS) - self.tokens)
+        score = max(0.0, score - VARIANT_PENALTY * extra_variants)
+        is_exact = match_count == len(self.tokens) and not extra_variants
+        # Parcial: falta a lo más una palabra (nunca un modelo/variante) y buena cobertura
+        is_partial = (not is_exact and len(self.tokens) > 1
+                      and match_count >= len(self.tokens) - 1 and score >= PARTIAL_MIN_SCORE)
+        return round(score, 4), match_count, is_exact, is_partial
+
+
+@lru_cache(maxsize=256)
+def compile_query(query: str) -> CompiledQuery:
+    return CompiledQuery(query)
+
+
+def score_batch(query: str, titles: List[str]) -> List[Tuple[float, int, bool, bool]]:
+    """Puntúa todos los títulos contra la misma query compilada."""
+    compiled = compile_query(query)
+    return [compiled.score(title) for title in titles]
+
+
+def rank_key(candidate: dict):
+    return (0 if candidate["is_exact"] else 1, candidate["price"], -candidate["score"], candidate["position"])
+
+
+def rank(candidates: List[dict]) -> List[dict]:
+    """Exactos primero, luego más barato, luego mejor puntaje."""
+    return sorted(candidates, key=rank_key)
+
+
+def select(ranking: List[dict], winner_depth: int, options_limit: int) -> Tuple[Optional[dict], List[dict]]:
+    """
+    Una pasada sobre el ranking: el ganador es el primero dentro de los primeros
+    `winner_depth` items de la página; las opciones, los primeros sin duplicados.
+    """
+    winner = None
+    options, seen = [], set()
+    for c in ranking:
+        if winner is None and c["position"] < winner_depth:
+            winner = c
+        key = (c["name"], c["url"])
+        if len(options) < options_limit and key not in seen:
+            seen.add(key)
+            options.append(c)
+        if winner is not None and len(options) >= options_limit:
+            break
+    return winner, options
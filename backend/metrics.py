@@ -0,0 +1,146 @@
+"""
+Métricas de tiempo del scraper y del API en formato Prometheus.
+
+Sin dependencias: histogramas con buckets fijos y contadores, indexados por
+etiquetas. `span()` y `@timed` miden un bloque o una función (sync o async) y
+`observe()` registra una duración ya medida (p.ej. las fases de crawl_store).
+`render()` produce el texto que expone GET /metrics y `summary()` el resumen
+que run_scraper.py guarda al final de cada corrida.
+"""
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Tuple
+
+# Segundos: de fases de matching (ms) a páginas lentas con Chromium
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+HELP = {
+    "scrape_phase_seconds": "Duración de cada fase de un crawl (cache, fetch, context, goto, wait, extract, match)",
+    "browser_launch_seconds": "Arranque de un Chromium del pool",
+    "scrape_job_seconds": "Duración total de un (query, tienda) o de una query completa",
+    "firestore_op_seconds": "Duración de operaciones contra Firestore",
+    "scrape_results_total": "Resultados por tienda y estado",
+    "firestore_timeouts_total": "Llamadas a Firestore que excedieron su timeout (firestore_io.call)",
+    "scrape_hedges_total": "Intentos de respaldo por tienda (slow = pasó su p95, retry = falló rápido)",
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+_lock = threading.Lock()
+_histograms: Dict[str, Dict[LabelKey, dict]] = {}
+_counters: Dict[str, Dict[LabelKey, float]] = {}
+
+
+def _key(labels: dict) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def observe(name: str, seconds: float, **labels):
+    with _lock:
+        series = _histograms.setdefault(name, {}).get(_key(labels))
+        if series is None:
+            series = _histograms[name][_key(labels)] = {"buckets": [0] * len(BUCKETS), "count": 0, "sum": 0.0}
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                series["buckets"][i] += 1
+        series["count"] += 1
+        series["sum"] += seconds
+
+
+def inc(name: str, value: float = 1, **labels):
+    with _lock:
+        series = _counters.setdefault(name, {})
+        key = _key(labels)
+        series[key] = series.get(key, 0) + value
+
+
+@contextmanager
+def span(name: str, **labels):
+    """with span("firestore_op_seconds", op="get_all"): ... (también dentro de corutinas)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def timed(name: str, **labels):
+    """Decorador equivalente a span() para funciones sync o async."""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name, **labels):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name, **labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _fmt_labels(key: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def render() -> str:
+    """Formato de exposición de texto de Prometheus (0.0.4)."""
+    lines = []
+    with _lock:
+        for name, series in sorted(_histograms.items()):
+            lines.append(f"# HELP {name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, s in sorted(series.items()):
+                for bound, count in zip(BUCKETS, s["buckets"]):
+                    lines.append(f"{name}_bucket{_fmt_labels(key, (('le', repr(bound)),))} {count}")
+                lines.append(f"{name}_bucket{_fmt_labels(key, (('le', '+Inf'),))} {s['count']}")
+                lines.append(f"{name}_sum{_fmt_labels(key)} {s['sum']:.6f}")
+                lines.append(f"{name}_count{_fmt_labels(key)} {s['count']}")
+        for name, series in sorted(_counters.items()):
+            lines.append(f"# HELP {name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} counter")
+            for key, value in sorted(series.items()):
+                lines.append(f"{name}{_fmt_labels(key)} {value:g}")
+    return "\n".join(lines) + "\n"
+
+
+def _quantile(q: float, s: dict) -> float:
+    """Estimación por interpolación lineal dentro del bucket (como histogram_quantile)."""
+    if not s["count"]:
+        return 0.0
+    rank = q * s["count"]
+    prev_bound, prev_count = 0.0, 0
+    for bound, count in zip(BUCKETS, s["buckets"]):
+        if count >= rank:
+            if count == prev_count:
+                return bound
+            return prev_bound + (bound - prev_bound) * (rank - prev_count) / (count - prev_count)
+        prev_bound, prev_count = bound, count
+    return BUCKETS[-1]
+
+
+def summary() -> dict:
+    """{métrica: [{labels, count, avg_s, p50_s, p95_s}], contadores: [{labels, value}]}"""
+    out = {}
+    with _lock:
+        for name, series in sorted(_histograms.items()):
+            out[name] = [{
+                "labels": dict(key),
+                "count": s["count"],
+                "avg_s": round(s["sum"] / s["count"], 4) if s["count"] else 0.0,
+                "p50_s": round(_quantile(0.5, s), 4),
+                "p95_s": round(_quantile(0.95, s), 4),
+            } for key, s in sorted(series.items())]
+        for name, series in sorted(_counters.items()):
+            out[name] = [{"labels": dict(key), "value": value} for key, value in sorted(series.items())]
+    return out
@@ -0,0 +1,124 @@
+"""
+Política de red declarativa por tienda para las páginas de Playwright.
+
+Cada tienda puede declarar en STORES una llave "network" que se combina con
+DEFAULT_POLICY:
+  block_types        -> tipos de recurso que nunca se descargan (imágenes, CSS, fuentes...)
+  block_third_party  -> bloquear todo lo que no sea del sitio de la tienda
+  allow              -> patrones (fnmatch sobre la URL) permitidos aunque sean de terceros
+  deny               -> patrones siempre bloqueados (analytics, ads, trackers)
+
+La política se compila una vez por tienda (regex únicas) y el BrowserPool instala
+UN route por contexto que consulta al NetworkGuard del préstamo en curso, en vez de
+un page.route por página. El guard cuenta peticiones, bloqueos por motivo y bytes
+transferidos (Resource Timing del documento) para ver el ahorro por página.
+"""
+import fnmatch
+import re
+from functools import lru_cache
+from typing import Optional
+from urllib.parse import urlsplit
+
+import fixtures
+
+DEFAULT_POLICY = {
+    "block_types": ["image", "media", "font", "stylesheet", "manifest", "texttrack", "eventsource", "websocket"],
+    "block_third_party": True,
+    "allow": [],
+    "deny": [
+        "*google-analytics.com/*", "*googletagmanager.com/*", "*doubleclick.net/*", "*googlesyndication.com/*",
+        "*googleadservices.com/*", "*facebook.net/*", "*facebook.com/tr*", "*hotjar.com/*", "*clarity.ms/*",
+        "*criteo.*", "*taboola.com/*", "*tiktok.com/*", "*newrelic.com/*", "*nr-data.net/*", "*/collect?*",
+    ],
+}
+
+# Sufijos de segundo nivel comunes en las tiendas (amazon.com.mx -> sitio "amazon.com.mx")
+_SECOND_LEVEL = {"com", "net", "org", "gob", "edu", "co"}
+
+# Suma de bytes transferidos según Resource Timing (solo lo que sí se descargó)
+TRANSFER_JS = """
+() => performance.getEntries()
+    .filter(e => e.entryType === "navigation" || e.entryType === "resource")
+    .reduce((sum, e) => sum + (e.transferSize || 0), 0)
+"""
+
+
+def site_of(host: str) -> str:
+    """Dominio registrable aproximado: 'listado.mercadolibre.com.mx' -> 'mercadolibre.com.mx'."""
+    labels = (host or "").lower().split(".")
+    if len(labels) >= 3 and len(labels[-1]) == 2 and labels[-2] in _SECOND_LEVEL:
+        return ".".join(labels[-3:])
+    return ".".join(labels[-2:])
+
+
+def _compile(patterns) -> Optional[re.Pattern]:
+    if not patterns:
+        return None
+    return re.compile("|".join(fnmatch.translate(p) for p in patterns), re.IGNORECASE)
+
+
+class NetworkPolicy:
+    """Política ya compilada para una tienda."""
+
+    def __init__(self, site: str, policy: dict):
+        self.site = site
+        self.block_types = frozenset(policy.get("block_types") or ())
+        self.block_third_party = bool(policy.get("block_third_party"))
+        self._allow = _compile(policy.get("allow"))
+        self._deny = _compile(policy.get("deny"))
+
+    def decide(self, url: str, resource_type: str) -> Optional[str]:
+        """None = dejar pasar; si no, el motivo del bloqueo."""
+        if fixtures.MODE == "replay":
+            # En replay solo existe el servidor local de fixtures
+            return None if fixtures.is_replay_url(url) else "replay"
+        if resource_type in self.block_types:
+            return "type"
+        if self._deny is not None and self._deny.match(url):
+            return "deny"
+        if self.block_third_party and resource_type != "document":
+            host = urlsplit(url).hostname or ""
+            if site_of(host) != self.site and not (self._allow is not None and self._allow.match(url)):
+                return "third_party"
+        return None
+
+
+@lru_cache(maxsize=64)
+def _policy_for(store_name: str, search_url: str, overrides: tuple) -> NetworkPolicy:
+    policy = {**DEFAULT_POLICY}
+    for key, value in overrides:
+        # allow/deny de la tienda se suman a los globales; lo demás reemplaza
+        policy[key] = list(DEFAULT_POLICY.get(key) or []) + list(value) if key in ("allow", "deny") else value
+    return NetworkPolicy(site_of(urlsplit(search_url).hostname or ""), policy)
+
+
+def policy_for(store: dict) -> NetworkPolicy:
+    overrides = tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in (store.get("network") or {}).items()))
+    return _policy_for(store["name"], store["search_url"], overrides)
+
+
+class NetworkGuard:
+    """Aplica la política de una tienda durante un préstamo de contexto y lleva la cuenta."""
+
+    def __init__(self, policy: NetworkPolicy):
+        self.policy = policy
+        self.stats = {"requests": 0, "blocked": 0, "blocked_by": {}, "bytes": 0}
+
+    async def handle(self, route):
+        request = route.request
+        self.stats["requests"] += 1
+        reason = self.policy.decide(request.url, request.resource_type)
+        if reason:
+            self.stats["blocked"] += 1
+            self.stats["blocked_by"][reason] = self.stats["blocked_by"].get(reason, 0) + 1
+            await route.abort()
+        else:
+            await route.continue_()
+
+    async def measure(self, page):
+        """Bytes transferidos por la página (estimado del navegador; cross-origin puede reportar 0)."""
+        try:
+            self.stats["bytes"] = int(await page.evaluate(TRANSFER_JS))
+        except Exception:
+            pass
+        return self.stats
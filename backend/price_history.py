@@ -0,0 +1,200 @@
+"""
+Historial de precios compacto y append-only.
+
+Cada observación (query, tienda, precio, timestamp) se agrega a un chunk por
+(query, tienda, mes): price_history/{query}__{tienda}__{YYYYMM}. Dentro del chunk
+los timestamps (minutos epoch) y los precios (centavos) se guardan como deltas
+codificados en varints (zigzag para precios) en campos bytes; con `t_last` y
+`p_last` agregar una muestra es solo concatenar unos pocos bytes, sin decodificar.
+Un mes de muestras cada 30 min ocupa ~3 KB por tienda.
+
+Las estadísticas (min/max/promedio/percentiles y "el más bajo en N días") se
+calculan vectorizadas con NumPy sobre la serie decodificada.
+"""
+import re
+import time
+import unicodedata
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import metrics
+
+HISTORY_COLLECTION = "price_history"
+MINUTES_PER_DAY = 24 * 60
+
+
+# --- Codificación ---
+
+def _zigzag(n: int) -> int:
+    return (n << 1) ^ (n >> 63)
+
+
+def _unzigzag(z: int) -> int:
+    return (z >> 1) ^ -(z & 1)
+
+
+def encode_varints(values: List[int]) -> bytes:
+    out = bytearray()
+    for v in values:
+        while True:
+            byte = v & 0x7F
+            v >>= 7
+            if v:
+                out.append(byte | 0x80)
+            else:
+                out.append(byte)
+                break
+    return bytes(out)
+
+
+def decode_varints(data: bytes) -> List[int]:
+    values, current, shift = [], 0, 0
+    for byte in data:
+        current |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(current)
+            current, shift = 0, 0
+    return values
+
+
+def slug(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"[^a-z0-9]+", "_", text.lower()).strip("_") or "_"
+
+
+def bucket_of(minute: int) -> str:
+    return datetime.fromtimestamp(minute * 60, tz=timezone.utc).strftime("%Y%m")
+
+
+def chunk_id(query_term: str, store: str, bucket: str) -> str:
+    return f"{slug(query_term)}__{slug(store)}__{bucket}"
+
+
+def append_to_chunk(chunk: Optional[dict], query_term: str, store: str, bucket: str, minute: int, cents: int) -> dict:
+    """Regresa el chunk con la observación agregada (deltas respecto a la última)."""
+    if not chunk or not chunk.get("n"):
+        chunk = {"query_term": query_term.lower(), "store": store, "bucket": bucket,
+                 "t": b"", "p": b"", "n": 0, "t_last": 0, "p_last": 0, "t_first": minute}
+    if minute <= chunk["t_last"]:
+        return chunk  # misma corrida o reloj atrasado: append-only, no reescribimos el pasado
+    chunk = dict(chunk)
+    chunk["t"] = bytes(chunk["t"]) + encode_varints([minute - chunk["t_last"]])
+    chunk["p"] = bytes(chunk["p"]) + encode_varints([_zigzag(cents - chunk["p_last"])])
+    chunk["t_last"] = minute
+    chunk["p_last"] = cents
+    chunk["n"] += 1
+    return chunk
+
+
+def decode_chunk(chunk: dict) -> Tuple[np.ndarray, np.ndarray]:
+    """(minutos epoch, precios en pesos) como arreglos NumPy."""
+    t = np.cumsum(np.array(decode_varints(bytes(chunk.get("t") or b"")), dtype=np.int64))
+    p = np.cumsum(np.array([_unzigzag(z) for z in decode_varints(bytes(chunk.get("p") or b""))], dtype=np.int64))
+    return t, p / 100.0
+
+
+# --- Escritura ---
+
+class PriceHistoryWriter:
+    """Junta las observaciones de una corrida y las agrega a sus chunks con una sola lectura."""
+
+    def __init__(self):
+        self._obs: Dict[str, dict] = {}  # chunk_id -> {"query_term", "store", "bucket", "points": [(min, cents)]}
+
+    def __len__(self):
+        return len(self._obs)
+
+    def add(self, query_term: str, results: List[dict], minute: Optional[int] = None):
+        minute = minute if minute is not None else int(time.time() // 60)
+        bucket = bucket_of(minute)
+        for r in results:
+            if r.get("status") != "success" or not r.get("price"):
+                continue
+            cid = chunk_id(query_term, r["store"], bucket)
+            entry = self._obs.setdefault(cid, {"query_term": query_term, "store": r["store"], "bucket": bucket, "points": []})
+            entry["points"].append((minute, int(round(float(r["price"]) * 100))))
+
+    @metrics.timed("firestore_op_seconds", op="history_read")
+    def flush_into(self, db, buffer):
+        """Lee los chunks afectados (get_all) y encola los chunks actualizados en el WriteBuffer."""
+        if not db or not self._obs:
+            return
+        pending, self._obs = self._obs, {}
+        try:
+            refs = [db.collection(HISTORY_COLLECTION).document(cid) for cid in pending]
+            existing = {snap.id: snap.to_dict() for snap in db.get_all(refs) if snap.exists}
+            for cid, entry in pending.items():
+                chunk = existing.get(cid)
+                for minute, cents in sorted(entry["points"]):
+                    chunk = append_to_chunk(chunk, entry["query_term"], entry["store"], entry["bucket"], minute, cents)
+                buffer.set_doc(HISTORY_COLLECTION, cid, chunk, check_hash=False)
+        except Exception as e:
+            print(f"Error appending price history: {e}")
+
+
+# --- Consulta ---
+
+def _months_back(now_minute: int, days: int) -> List[str]:
+    buckets = []
+    minute = now_minute - days * MINUTES_PER_DAY
+    while True:
+        b = bucket_of(minute)
+        if b not in buckets:
+            buckets.append(b)
+        if minute >= now_minute:
+            break
+        minute = min(now_minute, minute + 28 * MINUTES_PER_DAY)
+    return buckets
+
+
+@metrics.timed("firestore_op_seconds", op="history_load")
+def load_series(db, query_term: str, stores: List[str], days: int) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """Series por tienda de los últimos `days` días (lectura directa por id de chunk)."""
+    if not db:
+        return {}
+    now_minute = int(time.time() // 60)
+    buckets = _months_back(now_minute, days)
+    refs = [db.collection(HISTORY_COLLECTION).document(chunk_id(query_term, s, b)) for s in stores for b in buckets]
+    parts: Dict[str, List[Tuple[np.ndarray, np.ndarray]]] = {}
+    for snap in db.get_all(refs):
+        if snap.exists:
+            chunk = snap.to_dict()
+            parts.setdefault(chunk["store"], []).append(decode_chunk(chunk))
+    series = {}
+    start = now_minute - days * MINUTES_PER_DAY
+    for store, chunks in parts.items():
+        t = np.concatenate([c[0] for c in chunks])
+        p = np.concatenate([c[1] for c in chunks])
+        order = np.argsort(t, kind="stable")
+        t, p = t[order], p[order]
+        mask = t >= start
+        series[store] = (t[mask], p[mask])
+    return series
+
+
+def window_stats(t: np.ndarray, p: np.ndarray, now_minute: Optional[int] = None, windows=(7, 30, 90)) -> dict:
+    """min/max/avg/percentiles por ventana y desde hace cuántos días no se ve un precio menor."""
+    if t.size == 0:
+        return {"samples": 0}
+    now_minute = now_minute if now_minute is not None else int(time.time() // 60)
+    current = float(p[-1])
+    stats = {"samples": int(t.size), "current": current, "windows": {}}
+    for days in windows:
+        w = p[t >= now_minute - days * MINUTES_PER_DAY]
+        if w.size == 0:
+            continue
+        p10, p50, p90 = np.percentile(w, [10, 50, 90])
+        stats["windows"][f"{days}d"] = {
+            "samples": int(w.size), "min": float(w.min()), "max": float(w.max()), "avg": round(float(w.mean()), 2),
+            "p10": round(float(p10), 2), "p50": round(float(p50), 2), "p90": round(float(p90), 2),
+            "is_lowest": bool(current <= w.min()),
+        }
+    # "El más bajo en N días": última vez que hubo un precio estrictamente menor
+    lower = np.flatnonzero(p[:-1] < current)
+    since_minute = t[lower[-1]] if lower.size else t[0]
+    stats["lowest_in_days"] = round(float(now_minute - since_minute) / MINUTES_PER_DAY, 1)
+    return stats
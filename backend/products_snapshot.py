@@ -0,0 +1,86 @@
+"""
+Snapshot en memoria de la colección cached_results para GET /products.
+
+Un listener on_snapshot de Firestore mantiene la vista materializada: cada cambio
+re-aplana solo el documento afectado y recalcula el cuerpo JSON y su ETag una vez.
+Las peticiones se sirven desde memoria (sin lecturas a Firestore) y soportan
+consultas delta (since=updated_at), paginación y 304 Not Modified.
+"""
+import hashlib
+import json
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class ProductsSnapshot:
+    def __init__(self, flatten_doc: Callable[[str, dict], List[dict]]):
+        # flatten_doc(doc_id, data) -> filas ya validadas (con "updated_at")
+        self.flatten_doc = flatten_doc
+        self._docs: Dict[str, List[dict]] = {}
+        self._rows: List[dict] = []
+        self._body = b"[]"
+        self.etag = '"empty"'
+        self.version = 0
+        self._lock = threading.Lock()
+        self._watch = None
+        self.ready = threading.Event()
+
+    def start(self, db):
+        if self._watch or not db:
+            return
+        self._watch = db.collection("cached_results").on_snapshot(self._on_snapshot)
+        print("👂 [Snapshot] Escuchando cambios en cached_results.")
+
+    def stop(self):
+        if self._watch:
+            try:
+                self._watch.unsubscribe()
+            except Exception:
+                pass
+            self._watch = None
+        self.ready.clear()
+
+    def _on_snapshot(self, docs, changes, read_time):
+        # Corre en el hilo del listener de Firestore
+        try:
+            with self._lock:
+                for change in changes:
+                    doc = change.document
+                    if change.type.name == "REMOVED":
+                        self._docs.pop(doc.id, None)
+                    else:
+                        self._docs[doc.id] = self.flatten_doc(doc.id, doc.to_dict() or {})
+                self._rebuild()
+            self.ready.set()
+        except Exception as e:
+            print(f"⚠️ [Snapshot] Error aplicando cambios: {e}")
+
+    def _rebuild(self):
+        rows = [row for doc_rows in self._docs.values() for row in doc_rows]
+        rows.sort(key=lambda r: r.get("updated_at") or "")
+        self._rows = rows
+        self._body = json.dumps(rows, ensure_ascii=False).encode("utf-8")
+        self.etag = '"' + hashlib.md5(self._body).hexdigest() + '"'
+        self.version += 1
+
+    def query(self, since: Optional[str] = None, offset: int = 0, limit: Optional[int] = None) -> Tuple[bytes, str, int]:
+        """Regresa (cuerpo_json, etag, total_filtrado) para la vista pedida."""
+        with self._lock:
+            if not since and not offset and limit is None:
+                return self._body, self.etag, len(self._rows)
+            rows = self._rows
+        return render_rows(rows, since, offset, limit)
+
+
+def select_rows(rows: List[dict], since: Optional[str] = None, offset: int = 0, limit: Optional[int] = None) -> Tuple[List[dict], int]:
+    """Filtro delta (updated_at > since) + paginación. Regresa (página, total_filtrado)."""
+    if since:
+        rows = [r for r in rows if (r.get("updated_at") or "") > since]
+    end = None if limit is None else offset + limit
+    return rows[offset:end], len(rows)
+
+
+def render_rows(rows: List[dict], since: Optional[str] = None, offset: int = 0, limit: Optional[int] = None) -> Tuple[bytes, str, int]:
+    page, total = select_rows(rows, since, offset, limit)
+    body = json.dumps(page, ensure_ascii=False).encode("utf-8")
+    return body, '"' + hashlib.md5(body).hexdigest() + '"', total
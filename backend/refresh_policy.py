@@ -0,0 +1,98 @@
+"""
+Refresco adaptativo por volatilidad para el scraper programado.
+
+Cada query guarda su estado en refresh_state/{query_lowercase}:
+  change_rate   -> EWMA de "¿cambió el precio en este chequeo?" (0..1)
+  interval_min  -> minutos entre chequeos, derivado de change_rate y suscriptores
+  store_hashes  -> content_hash del resultado de cada tienda en su último chequeo exitoso
+  last_checked / last_changed / checks / changes
+
+Un cambio solo cuenta entre tiendas presentes en ambos chequeos: que una tienda
+falle o regrese no es un cambio de precio. Un chequeo en el que ninguna tienda
+respondió (errores o circuit breaker) no es un chequeo: no toca el estado y la
+query sigue vencida para la siguiente corrida.
+
+Las queries que cambian seguido se revisan cada corrida (30 min); las que llevan
+semanas iguales se espacian hasta MAX_INTERVAL_MIN. Más suscriptores acortan el
+intervalo. En cada corrida solo se toman las queries vencidas, ordenadas por qué
+tan atrasadas van (cola de prioridad).
+"""
+import heapq
+import math
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from write_buffer import content_hash
+
+STATE_COLLECTION = "refresh_state"
+MIN_INTERVAL_MIN = 30          # cadencia del cron
+MAX_INTERVAL_MIN = 20 * 60     # < 24h para que cached_results no caduque (get_cached_results)
+ALPHA = 0.3                    # peso del último chequeo en la EWMA
+INITIAL_CHANGE_RATE = 0.5      # queries nuevas arrancan a media cadencia
+
+
+def interval_minutes(change_rate: float, subscribers: int = 1) -> float:
+    """Interpola entre MAX (nunca cambia) y MIN (siempre cambia); más suscriptores = más seguido."""
+    # Escala logarítmica: desde el máximo baja rápido en cuanto aparecen cambios
+    rate = min(1.0, max(0.0, change_rate))
+    span = math.log(MAX_INTERVAL_MIN / MIN_INTERVAL_MIN)
+    interval = MAX_INTERVAL_MIN * math.exp(-span * rate)
+    interval /= 1 + math.log2(max(1, subscribers))
+    return round(min(MAX_INTERVAL_MIN, max(MIN_INTERVAL_MIN, interval)), 1)
+
+
+def store_hashes(results: List[dict]) -> Dict[str, str]:
+    """content_hash por tienda de los resultados exitosos de un chequeo."""
+    return {r["store"]: content_hash([r]) for r in results if r.get("store")}
+
+
+def next_state(prev: Optional[dict], query: str, hashes: Dict[str, str], subscribers: int, now: datetime) -> dict:
+    """Estado tras un chequeo. `hashes` vacío (sin resultados) cuenta como chequeo sin cambio."""
+    prev = prev or {}
+    rate = prev.get("change_rate", INITIAL_CHANGE_RATE)
+    previous = prev.get("store_hashes") or {}
+    changed = any(previous[store] != h for store, h in hashes.items() if store in previous)
+    rate = (1 - ALPHA) * rate + ALPHA * (1.0 if changed else 0.0)
+    now_iso = now.isoformat()
+    return {
+        "query": query,
+        "change_rate": round(rate, 4),
+        "interval_min": interval_minutes(rate, subscribers),
+        "last_checked": now_iso,
+        "last_changed": now_iso if changed else prev.get("last_changed"),
+        # Las tiendas ausentes conservan su último hash para compararse cuando regresen
+        "store_hashes": {**previous, **hashes},
+        "checks": prev.get("checks", 0) + 1,
+        "changes": prev.get("changes", 0) + (1 if changed else 0),
+    }
+
+
+def load_states(db) -> Dict[str, dict]:
+    if not db:
+        return {}
+    return {doc.id: doc.to_dict() or {} for doc in db.collection(STATE_COLLECTION).stream()}
+
+
+def overdue_ratio(state: Optional[dict], subscribers: int, now: datetime) -> float:
+    """>= 1 significa vencida. Queries sin historial son infinitamente prioritarias."""
+    if not state or not state.get("last_checked"):
+        return math.inf
+    try:
+        elapsed = (now - datetime.fromisoformat(state["last_checked"])).total_seconds() / 60
+    except Exception:
+        return math.inf
+    # El intervalo se recalcula con los suscriptores actuales
+    interval = interval_minutes(state.get("change_rate", INITIAL_CHANGE_RATE), subscribers)
+    # Margen de 5 min para que el jitter del cron no salte una corrida
+    return (elapsed + 5) / interval
+
+
+def due_queries(tracked_items: List[dict], states: Dict[str, dict], now: datetime, limit: Optional[int] = None) -> List[dict]:
+    """Queries vencidas, de la más atrasada a la menos; `limit` acota cuántas por corrida."""
+    heap = []
+    for i, item in enumerate(tracked_items):
+        ratio = overdue_ratio(states.get(item["query"].lower()), item.get("subscribers", 1), now)
+        if ratio >= 1:
+            heapq.heappush(heap, (-ratio, i, item))
+    count = len(heap) if limit is None else min(limit, len(heap))
+    return [heapq.heappop(heap)[2] for _ in range(count)]
@@ -1,40 +1,213 @@
+import argparse
 import asyncio
+import json
 import os
+from datetime import datetime
 # Importamos tus funciones del main.py
 # Asegúrate de que en main.py NO se ejecute uvicorn automáticamente al importar
-from main import scrape_and_cache, scrape_store_options, get_tracked_queries_db
-
-async def scrape_product(item):
-    """Scrapea un producto y sus opciones de comparación"""
-    product = item["query"]
-    print(f"\n--- Buscando: {product} ---")
-    await scrape_and_cache(product)
-    
-    print(f"\n🔍 Buscando opciones de comparación para: {product}")
-    await scrape_store_options(product)
-
-async def main():
-    print("🚀 Iniciando Scraper Programado en GitHub Actions...")
-    
-    tracked_items = get_tracked_queries_db()
+from main import STORES, ensure_firebase, scrape_store_once, persist_scrape, get_tracked_queries_db_async, browser_pool, listing_cache, listing_is_cached, store_health, selector_stats
+from static_fetch import close_client
+from scheduler import ScrapeScheduler
+from write_buffer import WriteBuffer
+from price_history import PriceHistoryWriter
+from alerts import load_snapshots, run_alerts
+from refresh_policy import STATE_COLLECTION, load_states, due_queries, next_state, store_hashes
+from sharding import parse_shard, select_shard, run_local
+import firestore_io
+import metrics
+
+# Workers simultáneos del scheduler (páginas abiertas a la vez en toda la corrida)
+WORKERS = int(os.environ.get("SCRAPER_WORKERS", len(STORES)))
+OPTIONS_LIMIT = 10
+# Un flush puede mandar varios batches de 500 escrituras
+FLUSH_TIMEOUT_S = 180
+# Resumen JSON de la corrida (tiempos, tasas de éxito, latencia por tienda)
+RUN_SUMMARY_PATH = os.environ.get("RUN_SUMMARY_PATH", "run_summary.json")
+# Tope opcional de queries por corrida (las más atrasadas primero); REFRESH_ALL=1 ignora la política
+MAX_QUERIES_PER_RUN = int(os.environ["MAX_QUERIES_PER_RUN"]) if os.environ.get("MAX_QUERIES_PER_RUN") else None
+
+async def main(shard=(0, 1)):
+    started_at = datetime.now()
+    shard_index, shard_total = shard
+    label = f" [shard {shard_index}/{shard_total}]" if shard_total > 1 else ""
+    print(f"🚀 Iniciando Scraper Programado en GitHub Actions...{label}")
+    db = await ensure_firebase()
+
+    tracked_items = await get_tracked_queries_db_async()
     if not tracked_items:
         print("⚠️ No hay productos rastreados en la base de datos.")
         return
 
-    print(f"📋 Encontrados {len(tracked_items)} productos para actualizar.")
-    
-    # Scraping en lotes de 3 para balance entre velocidad y seguridad
-    batch_size = 3
-    total_batches = (len(tracked_items) + batch_size - 1) // batch_size
-    
-    for i in range(0, len(tracked_items), batch_size):
-        batch_num = (i // batch_size) + 1
-        batch = tracked_items[i:i + batch_size]
-        
-        print(f"\n🔄 Procesando lote {batch_num}/{total_batches} ({len(batch)} productos en paralelo)")
-        await asyncio.gather(*[scrape_product(item) for item in batch])
-    
+    print(f"📋 Encontrados {len(tracked_items)} productos rastreados.")
+    # Cada shard se queda con sus queries (hash estable): nunca escribe documentos de otro shard
+    tracked_items = select_shard(tracked_items, shard_index, shard_total)
+    if shard_total > 1:
+        print(f"🧩 {len(tracked_items)} productos asignados a este shard.")
+
+    # Solo las queries vencidas según su volatilidad (ver refresh_policy.py)
+    states = await firestore_io.call(load_states, db, op="load_states", timeout=60, default={})
+    if os.environ.get("REFRESH_ALL") == "1":
+        due_items = tracked_items
+    else:
+        due_items = due_queries(tracked_items, states, datetime.now(), MAX_QUERIES_PER_RUN)
+    print(f"⏱️ {len(due_items)} de {len(tracked_items)} productos vencidos en esta corrida.")
+    if not due_items:
+        return
+
+    # Acumulado por query: se encola en cuanto terminan todas sus tiendas
+    pending = {}
+    subscribers = {item["query"]: item.get("subscribers", 1) for item in due_items}
+    # Todas las variantes de mayúsculas de cada query (toques de last_updated y alertas)
+    query_terms = {item["query"]: item.get("queries") or [item["query"]] for item in due_items}
+    # Escrituras diferidas: batches y sin reescribir documentos cuyo contenido no cambió
+    buffer = WriteBuffer(db, auto_flush=False)
+    # Historial append-only (una observación por tienda y query en cada corrida)
+    history = PriceHistoryWriter()
+    # (query, tienda) omitidos por circuit breaker, por tienda
+    skipped = {}
+    # Snapshot anterior de cached_results (una lectura get_all) para las alertas de baja de precio
+    previous = await firestore_io.call(load_snapshots, db, [item["query"] for item in due_items],
+                                       op="load_snapshots", timeout=60, default={})
+    alert_changes = []
+
+    async def run_job(job, paced):
+        return await scrape_store_once(job["store"], job["query"], OPTIONS_LIMIT, paced=paced)
+
+    async def on_done(job, outcome, error):
+        entry = pending[job["query"]]
+        entry["remaining"] -= 1
+        if outcome:
+            result, options = outcome
+            if result and result["status"] in ("success", "not_found"):
+                entry["answered"] += 1
+            if result and result["status"] == "success":
+                entry["results"].append(result)
+            elif result and result["status"] == "skipped":
+                skipped[job["store"]["name"]] = skipped.get(job["store"]["name"], 0) + 1
+            entry["options"].extend(options)
+        if entry["remaining"] == 0:
+            query = job["query"]
+            persist_scrape(query, entry["results"], entry["options"], buffer=buffer, query_terms=query_terms[query])
+            alert_changes.append((query, previous.get(query), entry["results"]))
+            history.add(query, entry["results"])
+            # Actualizar volatilidad observada e intervalo de la query; si ninguna tienda
+            # respondió (errores, breaker) no hubo chequeo y la query sigue vencida
+            if entry["answered"]:
+                state = next_state(states.get(query.lower()), query, store_hashes(entry["results"]),
+                                   subscribers[query], datetime.now())
+                buffer.set_doc(STATE_COLLECTION, query.lower(), state, check_hash=False)
+            if buffer.needs_flush():
+                # El flush (get_all + commits) corre en un hilo: los workers siguen scrapeando
+                await firestore_io.call(buffer.flush, op="buffer_flush", timeout=FLUSH_TIMEOUT_S)
+
+    scheduler = ScrapeScheduler(run_job, workers=WORKERS, on_done=on_done,
+                                cached=lambda job: listing_is_cached(job["store"], job["query"]))
+    for item in due_items:
+        product = item["query"]
+        pending[product] = {"remaining": len(STORES), "answered": 0, "results": [], "options": []}
+        for store in STORES:
+            scheduler.submit({"query": product, "store": store})
+
+    print(f"🔄 {scheduler.stats['jobs']} trabajos (query, tienda) en cola con {WORKERS} workers")
+    try:
+        stats = await scheduler.run()
+    finally:
+        await firestore_io.call(history.flush_into, db, buffer, op="history_flush", timeout=FLUSH_TIMEOUT_S)
+        await firestore_io.call(buffer.flush, op="buffer_flush", timeout=FLUSH_TIMEOUT_S)
+        if len(buffer):
+            # Un flush fallido deja en la cola lo que no se confirmó: un último intento antes de salir
+            await firestore_io.call(buffer.flush, op="buffer_flush", timeout=FLUSH_TIMEOUT_S)
+            if len(buffer):
+                print(f"⚠️ {len(buffer)} escrituras no se pudieron guardar en Firestore")
+        # Alertas después de guardar los precios nuevos; solo las queries con baja leen suscriptores
+        alert_stats = await firestore_io.call(run_alerts, db, alert_changes, query_terms, op="alerts", timeout=FLUSH_TIMEOUT_S, default={})
+        firestore_io.shutdown()
+        # Un solo Chromium para toda la corrida: se apaga al final
+        await browser_pool.close()
+        await close_client()
+        pruned = listing_cache.prune()
+        listing_cache.close()
+        store_health.save()
+        selector_stats.save()
+
+    print(f"\n📊 {stats['ok']} ok / {stats['failed']} fallidos en {stats['elapsed_s']}s "
+          f"({stats['jobs_per_min']} trabajos/min)")
+    w = buffer.stats
+    print(f"💾 Firestore: {w['written']} escritos, {w['skipped']} sin cambios, "
+          f"{w['touched']} trackings actualizados en {w['commits']} commits")
+    if alert_stats:
+        print(f"🔔 Alertas: {alert_stats['alerts']} enviadas, {alert_stats['changed']} de {alert_stats['queries']} "
+              f"productos bajaron ({alert_stats['subscribers_read']} suscriptores leídos)")
+    lc = listing_cache.stats
+    print(f"🗄️ Caché de listados: {lc['hits']} hits, {lc['misses']} misses, {lc['writes']} guardados, {pruned} vencidos borrados")
+    health = store_health.snapshot()
+    for store_name, s in stats["per_store"].items():
+        done = s["ok"] + s["failed"]
+        avg = s["seconds"] / done if done else 0
+        h = health.get(store_name, {})
+        breaker = f" 🚧 {skipped[store_name]} omitidos por breaker" if skipped.get(store_name) else ""
+        print(f"   • {store_name}: {s['ok']}/{done} ok, {avg:.1f}s promedio, goto timeout {h.get('goto_timeout_ms', '-')}ms{breaker}")
+
+    selectors = selector_stats.report(STORES)
+    for store_name, fields in selectors.items():
+        for field, r in fields.items():
+            for selector in r["dead"]:
+                print(f"   💀 Selector muerto en {store_name} ({field}): {selector}")
+    write_summary(shard, started_at, len(tracked_items), len(due_items), stats, w, lc, skipped, alert_stats)
     print("\n✅ Todo terminado. Apagando.")
 
+def write_summary(shard, started_at: datetime, tracked: int, due: int, stats: dict, writes: dict, listings: dict,
+                  skipped: dict, alerts: dict):
+    """Resumen legible por máquina; con shards, un archivo por shard (run_summary.0of2.json)."""
+    shard_index, shard_total = shard
+    path = RUN_SUMMARY_PATH
+    if shard_total > 1:
+        root, ext = os.path.splitext(path)
+        path = f"{root}.{shard_index}of{shard_total}{ext or '.json'}"
+    per_store = {}
+    for store_name, s in stats["per_store"].items():
+        done = s["ok"] + s["failed"]
+        per_store[store_name] = {
+            "jobs": done,
+            "ok": s["ok"],
+            "success_rate": round(s["ok"] / done, 3) if done else None,
+            "avg_latency_s": round(s["seconds"] / done, 2) if done else None,
+            "skipped_by_breaker": skipped.get(store_name, 0),
+        }
+    summary = {
+        "started_at": started_at.isoformat(),
+        "finished_at": datetime.now().isoformat(),
+        "shard": f"{shard_index}/{shard_total}",
+        "queries": {"tracked": tracked, "due": due},
+        "jobs": {k: stats[k] for k in ("jobs", "ok", "failed", "elapsed_s", "jobs_per_min") if k in stats},
+        "success_rate": round(stats["ok"] / stats["jobs"], 3) if stats.get("jobs") else None,
+        "per_store": per_store,
+        "firestore": writes,
+        "listing_cache": listings,
+        "alerts": alerts,
+        "store_health": store_health.snapshot(),
+        "selectors": selector_stats.report(STORES),
+        "timings": metrics.summary(),
+    }
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"🧾 Resumen de la corrida en {path}")
+    except OSError as e:
+        print(f"⚠️ No se pudo escribir el resumen: {e}")
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Scraper programado de queries rastreadas")
+    parser.add_argument("--shard", default="0/1", help="Procesar solo el shard i de N (p.ej. 1/4 en un job matrix)")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="Modo local: N procesos, uno por shard (0 = uno por CPU)")
+    args = parser.parse_args()
+
+    if args.processes is not None:
+        processes = args.processes or os.cpu_count() or 1
+        raise SystemExit(run_local(processes, os.path.abspath(__file__)))
+    try:
+        shard = parse_shard(args.shard)
+    except ValueError as e:
+        parser.error(str(e))
+    asyncio.run(main(shard))
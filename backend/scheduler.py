@@ -0,0 +1,211 @@
+"""
+Scheduler de trabajos (query, tienda) para el scraper programado.
+
+Cada trabajo es un par (query, tienda). Los trabajos se encolan por dominio de tienda
+y un pool de workers compartido los ejecuta en cuanto su tienda tiene cupo:
+  - token bucket por dominio (peticiones por minuto + ráfaga)
+  - tope de concurrencia por dominio
+  - pausa de cortesía entre peticiones al mismo dominio
+Así el navegador siempre tiene trabajo y ninguna tienda recibe más de lo permitido.
+"""
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+# Límites por defecto si la tienda no define "limits" en STORES
+DEFAULT_LIMITS = {
+    "rate_per_min": 30,   # peticiones por minuto (token bucket)
+    "burst": 2,           # ráfaga máxima del bucket
+    "concurrency": 2,     # páginas simultáneas contra el dominio
+    "delay": 1.0,         # segundos mínimos entre arranques de petición
+}
+
+# Procesos del scraper que comparten IP (sharding.run_local lo define): cada uno
+# recibe su parte de los límites para que la suma no pase de lo permitido
+PROCESSES = max(1, int(os.environ.get("SCRAPER_PROCESSES", 1)))
+
+
+def store_domain(store: dict) -> str:
+    return urlparse(store["search_url"]).netloc
+
+
+class TokenBucket:
+    def __init__(self, rate_per_min: float, burst: int):
+        self.rate = rate_per_min / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class StoreLimiter:
+    """Token bucket + tope de concurrencia + pausa de cortesía para un dominio."""
+
+    def __init__(self, rate_per_min: float, burst: int, concurrency: int, delay: float):
+        self.bucket = TokenBucket(rate_per_min, burst)
+        self.delay = delay
+        self.slots = asyncio.Semaphore(max(1, concurrency))
+        self._last_start = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire_slot(self):
+        await self.slots.acquire()
+
+    async def try_acquire_slot(self) -> bool:
+        """Toma un cupo solo si hay uno libre ahora mismo (intentos de respaldo: nunca esperan)."""
+        if self.slots.locked():
+            return False
+        await self.slots.acquire()
+        return True
+
+    async def pace(self):
+        """Token + pausa de cortesía; llamarlo justo antes de la petición (ya con worker)."""
+        await self.bucket.acquire()
+        async with self._lock:
+            wait = self._last_start + self.delay - time.monotonic()
+            if wait > 0:
+                # Un poco de jitter para no pegarle al sitio con un patrón fijo
+                await asyncio.sleep(wait + random.uniform(0, self.delay * 0.25))
+            self._last_start = time.monotonic()
+
+    async def acquire(self):
+        await self.acquire_slot()
+        try:
+            await self.pace()
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release(self):
+        self.slots.release()
+
+    @classmethod
+    def for_store(cls, store: dict, processes: int = PROCESSES) -> "StoreLimiter":
+        """
+        Límites de la tienda divididos entre `processes`: ritmo y ráfaga se reparten y la
+        pausa se multiplica. La concurrencia no baja de 1 por proceso; con más procesos
+        que `concurrency` lo que acota a la tienda es el ritmo combinado.
+        """
+        limits = {**DEFAULT_LIMITS, **store.get("limits", {})}
+        return cls(
+            limits["rate_per_min"] / processes,
+            max(1, limits["burst"] // processes),
+            max(1, limits["concurrency"] // processes),
+            limits["delay"] * processes,
+        )
+
+
+# Un limitador por dominio para todo el proceso: trabajos del scheduler, intentos
+# de respaldo (hedge/reintento) y cualquier otro crawl comparten el mismo cupo
+_limiters: Dict[str, StoreLimiter] = {}
+
+
+def limiter_for(store: dict) -> StoreLimiter:
+    domain = store_domain(store)
+    if domain not in _limiters:
+        _limiters[domain] = StoreLimiter.for_store(store)
+    return _limiters[domain]
+
+
+class ScrapeScheduler:
+    """
+    Ejecuta trabajos {"query": str, "store": dict} con `run_job(job, paced)` usando `workers` workers.
+    `on_done(job, result, error)` se llama al terminar cada trabajo (para agregar por query).
+    `cached(job)` = el trabajo se sirve sin pedirle nada a la tienda (listing_cache): no
+    toma cupo ni pausa del dominio y run_job recibe paced=False (si el listado venció
+    entretanto, el crawl se cobra el limitador él mismo).
+    """
+
+    def __init__(
+        self,
+        run_job: Callable[[dict, bool], Awaitable],
+        workers: int = 4,
+        on_done: Optional[Callable[[dict, object, Optional[Exception]], Awaitable]] = None,
+        cached: Optional[Callable[[dict], bool]] = None,
+    ):
+        self.run_job = run_job
+        self.on_done = on_done
+        self.cached = cached
+        self.workers = asyncio.Semaphore(max(1, workers))
+        self.limiters: Dict[str, StoreLimiter] = {}
+        self.lanes: Dict[str, deque] = {}
+        self.stats = {"jobs": 0, "ok": 0, "failed": 0, "per_store": {}}
+
+    def submit(self, job: dict):
+        domain = store_domain(job["store"])
+        if domain not in self.limiters:
+            self.limiters[domain] = limiter_for(job["store"])
+            self.lanes[domain] = deque()
+        self.lanes[domain].append(job)
+        self.stats["jobs"] += 1
+
+    async def _execute(self, domain: str, job: dict, paced: bool):
+        store_stats = self.stats["per_store"].setdefault(job["store"]["name"], {"ok": 0, "failed": 0, "seconds": 0.0})
+        start = time.monotonic()
+        result, error = None, None
+        try:
+            # La pausa corre con el worker ya asignado: si corriera antes, varios trabajos
+            # del mismo dominio la cumplirían esperando worker y arrancarían pegados
+            if paced:
+                await self.limiters[domain].pace()
+            start = time.monotonic()
+            result = await self.run_job(job, paced)
+            self.stats["ok"] += 1
+            store_stats["ok"] += 1
+        except Exception as e:
+            error = e
+            self.stats["failed"] += 1
+            store_stats["failed"] += 1
+            print(f"❌ [Scheduler] {job['store']['name']} / {job['query']}: {e}")
+        finally:
+            store_stats["seconds"] += time.monotonic() - start
+            if paced:
+                self.limiters[domain].release()
+            self.workers.release()
+        if self.on_done:
+            await self.on_done(job, result, error)
+
+    async def _dispatch(self, domain: str) -> List[asyncio.Task]:
+        """Despacha la cola de un dominio respetando sus límites y el pool de workers."""
+        tasks = []
+        lane = self.lanes[domain]
+        limiter = self.limiters[domain]
+        while lane:
+            job = lane.popleft()
+            paced = not (self.cached and self.cached(job))
+            if paced:
+                await limiter.acquire_slot()
+            try:
+                await self.workers.acquire()
+            except BaseException:
+                if paced:
+                    limiter.release()
+                raise
+            tasks.append(asyncio.create_task(self._execute(domain, job, paced)))
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return tasks
+
+    async def run(self) -> dict:
+        """Procesa todos los trabajos encolados y regresa estadísticas de la corrida."""
+        start = time.monotonic()
+        await asyncio.gather(*[self._dispatch(domain) for domain in list(self.lanes)])
+        elapsed = time.monotonic() - start
+        self.stats["elapsed_s"] = round(elapsed, 2)
+        done = self.stats["ok"] + self.stats["failed"]
+        self.stats["jobs_per_min"] = round(done / (elapsed / 60), 2) if elapsed > 0 else 0.0
+        return self.stats
@@ -0,0 +1,175 @@
+"""
+Estadísticas de variantes de selector por tienda y campo (item, title, price, link).
+
+EXTRACT_JS y static_fetch.extract_from_html reportan, por campo, qué variante
+acertó y cuáles se probaron antes sin éxito (`probes`). Aquí se acumulan aciertos,
+fallos, la fecha del último acierto y una tasa de acierto reciente (EWMA por
+página), y order() pone primero la variante con mejor tasa reciente: en Amazon el
+selector "nuclear" deja de pagar los fallos de las variantes viejas en cada página.
+
+Como los selectores se prueban solo hasta el primero que acierta, una variante que
+quedó atrás dejaría de medirse; por eso cada REPROBE_EVERY páginas se usa el orden
+de STORES, y en `item` una variante de respaldo (más amplia) nunca pasa delante de
+la principal mientras esta siga acertando. Las variantes nunca se descartan (el
+sitio puede volver a su diseño anterior); las que llevan DEAD_AFTER fallos sin un
+acierto reciente aparecen en report().
+
+Persisten en backend/.cache/selector_stats.json (restaurado por el workflow);
+save() suma al archivo solo lo contado por este proceso (state_file.update), así
+los shards locales de sharding.run_local no se pisan.
+
+Uso: python selector_stats.py  -> imprime el reporte de variantes muertas.
+"""
+import os
+import time
+from typing import Dict, List, Optional
+
+import state_file
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "selector_stats.json")
+DEAD_AFTER = 20                 # fallos sin acierto reciente para reportarla como muerta
+STALE_AFTER_S = 14 * 24 * 3600  # "reciente" = últimas 2 semanas
+RATE_ALPHA = 0.2                # peso de la última página en la tasa reciente
+RATE_PRIOR = 0.5                # tasa de partida de una variante sin historial
+PROMOTE_MARGIN = 0.1            # ventaja mínima para pasar delante de la principal
+PRIMARY_KEEP_RATE = 0.5         # item: la principal conserva su lugar con esta tasa
+REPROBE_EVERY = 10              # cada N páginas se prueba el orden de STORES
+
+
+class SelectorStats:
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = path
+        # store -> field -> selector -> {"hits", "misses", "last_hit", "rate"}
+        self._stats: Dict[str, Dict[str, Dict[str, dict]]] = {}
+        # Lo contado por este proceso y aún no guardado (misma forma que _stats)
+        self._unsaved: Dict[str, Dict[str, Dict[str, dict]]] = {}
+        self._calls: Dict[tuple, int] = {}
+        self._loaded = False
+
+    def load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        self._stats = state_file.read(self.path)
+
+    def save(self):
+        if not self._unsaved:
+            return
+        try:
+            state_file.update(self.path, lambda data: self._add(data, self._unsaved), indent=1)
+            self._unsaved = {}
+        except OSError as e:
+            print(f"⚠️ [Selectors] No se pudo guardar {self.path}: {e}")
+
+    @staticmethod
+    def _add(target: dict, stats: dict) -> dict:
+        for store, fields in stats.items():
+            for field, rows in fields.items():
+                out = target.setdefault(store, {}).setdefault(field, {})
+                for selector, e in rows.items():
+                    entry = out.setdefault(selector, {"hits": 0, "misses": 0, "last_hit": None})
+                    entry["hits"] += e["hits"]
+                    entry["misses"] += e["misses"]
+                    if e["last_hit"] and (entry["last_hit"] or 0) < e["last_hit"]:
+                        entry["last_hit"] = e["last_hit"]
+                    if e.get("rate") is not None:
+                        # La tasa no se suma: gana la más nueva
+                        entry["rate"] = e["rate"]
+        return target
+
+    @staticmethod
+    def _rate(entry: Optional[dict]) -> float:
+        if not entry:
+            return RATE_PRIOR
+        if entry.get("rate") is not None:
+            return entry["rate"]
+        probes = entry["hits"] + entry["misses"]
+        return entry["hits"] / probes if probes else RATE_PRIOR
+
+    def record(self, store: str, probes: Optional[dict]):
+        """probes = {campo: {selector: [aciertos, fallos]}} de una página."""
+        if not probes:
+            return
+        self.load()
+        now = int(time.time())
+        current = self._stats.get(store, {})
+        page = {store: {
+            field: {selector: {
+                "hits": hits,
+                "misses": misses,
+                "last_hit": now if hits else None,
+                "rate": round((1 - RATE_ALPHA) * self._rate(current.get(field, {}).get(selector))
+                              + RATE_ALPHA * hits / (hits + misses), 4) if hits + misses else None,
+            } for selector, (hits, misses) in rows.items()}
+            for field, rows in probes.items()
+        }}
+        self._add(self._stats, page)
+        self._add(self._unsaved, page)
+
+    def order(self, store: str, field: str, variants: List[str]) -> List[str]:
+        """La variante con mejor tasa reciente primero; el resto en el orden de STORES."""
+        self.load()
+        variants = list(variants)
+        calls = self._calls[(store, field)] = self._calls.get((store, field), 0) + 1
+        if len(variants) < 2 or calls % REPROBE_EVERY == 0:
+            # Re-prueba periódica del orden configurado: la principal puede recuperarse
+            return variants
+        stats = self._stats.get(store, {}).get(field, {})
+        primary = self._rate(stats.get(variants[0]))
+        if field == "item" and primary >= PRIMARY_KEEP_RATE:
+            return variants
+        best = max(variants[1:], key=lambda v: self._rate(stats.get(v)) if v in stats else -1.0)
+        if best not in stats or self._rate(stats[best]) < primary + PROMOTE_MARGIN:
+            return variants
+        return [best] + [v for v in variants if v != best]
+
+    def report(self, stores: Optional[List[dict]] = None) -> dict:
+        """
+        {tienda: {campo: {"variants": [{selector, hits, misses, hit_rate}], "dead": [...]}}}.
+        Con `stores` (STORES) solo se reportan las variantes que siguen configuradas.
+        """
+        self.load()
+        configured = None
+        if stores is not None:
+            configured = {
+                s["name"]: {f: set(v if isinstance(v, list) else [v]) for f, v in s["selectors"].items() if f != "no_results"}
+                for s in stores
+            }
+        now = time.time()
+        out = {}
+        for store, fields in self._stats.items():
+            for field, stats in fields.items():
+                variants, dead = [], []
+                for selector, e in stats.items():
+                    if configured is not None and selector not in configured.get(store, {}).get(field, ()):
+                        continue
+                    probes = e["hits"] + e["misses"]
+                    variants.append({
+                        "selector": selector,
+                        "hits": e["hits"],
+                        "misses": e["misses"],
+                        "hit_rate": round(e["hits"] / probes, 3) if probes else None,
+                    })
+                    recent = e.get("last_hit") and now - e["last_hit"] < STALE_AFTER_S
+                    if e["misses"] >= DEAD_AFTER and not recent:
+                        dead.append(selector)
+                if variants:
+                    out.setdefault(store, {})[field] = {"variants": variants, "dead": dead}
+        return out
+
+
+def print_report(report: dict):
+    if not report:
+        print("Sin estadísticas de selectores todavía.")
+        return
+    for store, fields in report.items():
+        print(f"🏪 {store}")
+        for field, r in fields.items():
+            for v in r["variants"]:
+                mark = "💀" if v["selector"] in r["dead"] else "  "
+                rate = f"{v['hit_rate']:.0%}" if v["hit_rate"] is not None else "-"
+                print(f"   {mark} {field:<5} {rate:>5}  {v['hits']:>6} aciertos / {v['misses']:>6} fallos  {v['selector']}")
+
+
+if __name__ == "__main__":
+    print_report(SelectorStats(os.environ.get("SELECTOR_STATS_PATH", DEFAULT_PATH)).report())
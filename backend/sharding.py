@@ -0,0 +1,59 @@
+"""
+Reparto de queries rastreadas entre varias corridas del scraper.
+
+Cada query cae siempre en el mismo shard (hash estable de la query normalizada),
+así varias corridas en paralelo -un job matrix de GitHub Actions o varios procesos
+locales- nunca escriben los mismos documentos: cached_results, store_options,
+refresh_state, price_history y los trackings se indexan por query.
+"""
+import hashlib
+import os
+import subprocess
+import sys
+from typing import List, Tuple
+
+from matching import normalize_text
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """'i/N' (0 <= i < N) -> (i, N)."""
+    try:
+        index, total = (int(part) for part in value.split("/", 1))
+    except ValueError:
+        raise ValueError(f"Shard inválido '{value}': se espera i/N, p.ej. 0/4")
+    if total < 1 or not 0 <= index < total:
+        raise ValueError(f"Shard inválido '{value}': se requiere 0 <= i < N")
+    return index, total
+
+
+def shard_of(query: str, total: int) -> int:
+    # sha1 y no hash(): hash() cambia entre procesos (PYTHONHASHSEED)
+    digest = hashlib.sha1(normalize_text(query).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % total
+
+
+def select_shard(items: List[dict], index: int, total: int) -> List[dict]:
+    if total <= 1:
+        return items
+    return [item for item in items if shard_of(item["query"], total) == index]
+
+
+def run_local(processes: int, script: str, extra_args: List[str] = ()) -> int:
+    """
+    Lanza `processes` procesos del scraper (uno por shard, un Chromium cada uno)
+    y espera a que terminen. Regresa el peor código de salida. Los procesos comparten
+    .cache/: la caché de listados es SQLite y store_health / selector_stats guardan
+    con merge bajo lock (state_file.py). También comparten la IP: SCRAPER_PROCESSES
+    hace que cada uno use 1/N de los límites por tienda (scheduler.StoreLimiter.for_store).
+    """
+    env = {**os.environ, "BROWSER_POOL_SIZE": "1", "SCRAPER_PROCESSES": str(processes)}
+    children = [
+        subprocess.Popen([sys.executable, script, "--shard", f"{i}/{processes}", *extra_args], env=env)
+        for i in range(processes)
+    ]
+    print(f"🧩 {processes} procesos lanzados (uno por shard).")
+    codes = [child.wait() for child in children]
+    for i, code in enumerate(codes):
+        if code:
+            print(f"❌ Shard {i}/{processes} terminó con código {code}")
+    return max(codes, default=0)
@@ -0,0 +1,59 @@
+"""
+Archivos JSON de estado aprendido (.cache/store_health.json, selector_stats.json).
+
+Varios procesos del scraper (sharding.run_local) comparten el mismo archivo y
+todos guardan al terminar. update() relee el archivo bajo un lock exclusivo,
+le aplica solo lo que este proceso aprendió y lo reemplaza de forma atómica:
+ningún shard pisa lo que guardó otro.
+"""
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import Callable
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin lock entre procesos (un solo proceso local)
+    fcntl = None
+
+
+def read(path: str) -> dict:
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+@contextmanager
+def _locked(path: str):
+    if fcntl is None:
+        yield
+        return
+    with open(path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def update(path: str, apply: Callable[[dict], dict], indent=None):
+    """Lee el archivo actual, escribe apply(actual). Lanza OSError si no se puede escribir."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    with _locked(path):
+        data = apply(read(path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".json")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=indent)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
@@ -0,0 +1,108 @@
+"""
+Ruta sin navegador para tiendas que entregan el listado en HTML del servidor.
+
+Un cliente httpx compartido (keep-alive + HTTP/2) descarga la página de búsqueda y
+selectolax aplica los mismos selectores de STORES. Devuelve el mismo formato que
+EXTRACT_JS en main.py, así el matching y ranking en Python no cambian.
+Si el parseo estático no encuentra items, el llamador usa Playwright.
+"""
+import random
+from typing import List, Optional
+from urllib.parse import urljoin
+
+import httpx
+from selectolax.lexbor import LexborHTMLParser
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_client(user_agents: List[str]) -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=True,
+            follow_redirects=True,
+            timeout=httpx.Timeout(20.0, connect=10.0),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60),
+            headers={
+                "User-Agent": random.choice(user_agents),
+                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+                "Accept-Language": "es-MX,es;q=0.9,en;q=0.7",
+            },
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _text(node) -> str:
+    return (node.text(separator=" ", strip=True) or "").strip()
+
+
+def extract_from_html(html: str, spec: dict, base_url: str) -> dict:
+    """Equivalente estático de EXTRACT_JS: {"no_results", "selector", "total", "items", "probes"}."""
+    tree = LexborHTMLParser(html)
+    probes = {"item": {}, "title": {}, "price": {}, "link": {}}
+
+    def tally(field, sels, hit_index):
+        upto = len(sels) if hit_index < 0 else hit_index + 1
+        for i in range(upto):
+            row = probes[field].setdefault(sels[i], [0, 0])
+            row[0 if i == hit_index else 1] += 1
+
+    selector, nodes, item_hit = None, [], -1
+    for i, sel in enumerate(spec["item"]):
+        found = tree.css(sel)
+        if found:
+            selector, nodes, item_hit = sel, found, i
+            break
+
+    # Sin visibilidad en HTML estático: el aviso solo cuenta si además no hay items
+    if not nodes and spec.get("no_results") and tree.css_first(spec["no_results"]):
+        return {"no_results": True, "selector": None, "total": 0, "items": [], "probes": probes}
+    tally("item", spec["item"], item_hit)
+
+    def first(node, field, accept):
+        for i, s in enumerate(spec[field]):
+            el = node.css_first(s)
+            if el is not None and accept(el):
+                tally(field, spec[field], i)
+                return el
+        tally(field, spec[field], -1)
+        return None
+
+    items = []
+    for node in nodes[:spec["limit"]]:
+        el = first(node, "title", lambda el: True)
+        title = _text(el) if el is not None else ""
+        el = first(node, "price", lambda el: bool(_text(el)))
+        price_text = _text(el) if el is not None else ""
+        el = first(node, "link", lambda el: True)
+        href = (el.attributes.get("href") or "") if el is not None else ""
+        if href:
+            href = urljoin(base_url, href)
+        items.append({"title": title, "price_text": price_text, "href": href})
+
+    return {"no_results": False, "selector": selector, "total": len(nodes), "items": items, "probes": probes}
+
+
+async def fetch_listing(url: str, spec: dict, user_agents: List[str], keep_html: bool = False) -> Optional[dict]:
+    """
+    Descarga y parsea; None si la respuesta no sirve (bloqueo, error HTTP, red).
+    Con keep_html=True el resultado trae además "html" (para grabar fixtures).
+    """
+    try:
+        response = await get_client(user_agents).get(url)
+    except httpx.HTTPError:
+        return None
+    if response.status_code != 200 or "html" not in response.headers.get("content-type", "html"):
+        return None
+    extracted = extract_from_html(response.text, spec, str(response.url))
+    if keep_html:
+        extracted["html"] = response.text
+    return extracted
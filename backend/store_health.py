@@ -0,0 +1,146 @@
+"""
+Salud por tienda: latencias aprendidas, timeouts derivados y circuit breaker.
+
+Por tienda se guardan las últimas WINDOW duraciones exitosas de `goto`, de la
+espera de selectores (`wait`) y del crawl completo (`total`). Con al menos
+MIN_SAMPLES muestras los timeouts salen del p95 (con margen y topes) en lugar de
+los fijos de 60 s / 10 s, y el p95 del total marca cuándo lanzar un intento de
+respaldo (hedge). Las ventanas persisten en un JSON junto a la caché de listados
+para que cada corrida del cron arranque con lo aprendido; save() solo agrega las
+muestras nuevas de este proceso (state_file.update), así los shards locales de
+sharding.run_local no se pisan.
+
+El breaker abre tras FAILURES_TO_OPEN fallas seguidas de una tienda y la salta
+durante COOLDOWN_S (más que una corrida del cron): sus resultados salen con
+status "skipped" en vez de quemar un timeout por query. En tiendas sin selector
+de "sin resultados" un timeout suelto no es concluyente, pero TIMEOUTS_TO_FAIL
+seguidos sí cuentan como falla (captcha o bloqueo que no se reconoció).
+"""
+import os
+import time
+from collections import deque
+from typing import Dict, Optional
+
+import numpy as np
+
+import state_file
+
+WINDOW = 50
+MIN_SAMPLES = 5
+TIMEOUT_FACTOR = 2.5           # timeout = p95 * factor, dentro de los topes
+GOTO_TIMEOUT_MS = (8000, 60000)
+WAIT_TIMEOUT_MS = (3000, 10000)
+HEDGE_MIN_S = 2.0              # nunca duplicar páginas que tardan menos que esto
+FAILURES_TO_OPEN = int(os.environ.get("CIRCUIT_BREAKER_FAILURES", 3))
+TIMEOUTS_TO_FAIL = 2
+COOLDOWN_S = float(os.environ.get("CIRCUIT_BREAKER_COOLDOWN_S", 45 * 60))
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "store_health.json")
+
+
+class StoreHealth:
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = path
+        self._samples: Dict[str, Dict[str, deque]] = {}
+        # Muestras registradas por este proceso y aún no guardadas
+        self._unsaved: Dict[str, Dict[str, list]] = {}
+        self._failures: Dict[str, int] = {}
+        self._timeouts: Dict[str, int] = {}
+        self._open_until: Dict[str, float] = {}
+        self._loaded = False
+
+    # --- Persistencia ---
+
+    def load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        for store, kinds in state_file.read(self.path).items():
+            for kind, values in kinds.items():
+                self._series(store, kind).extend(float(v) for v in values[-WINDOW:])
+
+    def save(self):
+        if not self._unsaved:
+            return
+
+        def merge(data: dict) -> dict:
+            for store, kinds in self._unsaved.items():
+                for kind, values in kinds.items():
+                    series = data.setdefault(store, {}).setdefault(kind, [])
+                    series[:] = (series + values)[-WINDOW:]
+            return data
+
+        try:
+            state_file.update(self.path, merge)
+            self._unsaved = {}
+        except OSError as e:
+            print(f"⚠️ [Health] No se pudo guardar {self.path}: {e}")
+
+    # --- Latencias ---
+
+    def _series(self, store: str, kind: str) -> deque:
+        return self._samples.setdefault(store, {}).setdefault(kind, deque(maxlen=WINDOW))
+
+    def record(self, store: str, kind: str, seconds: float):
+        self.load()
+        self._series(store, kind).append(round(seconds, 3))
+        self._unsaved.setdefault(store, {}).setdefault(kind, []).append(round(seconds, 3))
+
+    def p95(self, store: str, kind: str) -> Optional[float]:
+        self.load()
+        values = self._samples.get(store, {}).get(kind)
+        if not values or len(values) < MIN_SAMPLES:
+            return None
+        return float(np.percentile(np.fromiter(values, dtype=float), 95))
+
+    def _timeout_ms(self, store: str, kind: str, bounds) -> int:
+        p95 = self.p95(store, kind)
+        if p95 is None:
+            return bounds[1]
+        return int(min(bounds[1], max(bounds[0], p95 * 1000 * TIMEOUT_FACTOR)))
+
+    def goto_timeout_ms(self, store: str) -> int:
+        return self._timeout_ms(store, "goto", GOTO_TIMEOUT_MS)
+
+    def wait_timeout_ms(self, store: str) -> int:
+        return self._timeout_ms(store, "wait", WAIT_TIMEOUT_MS)
+
+    def hedge_after_s(self, store: str) -> Optional[float]:
+        """Segundos tras los cuales conviene un segundo intento (p95 del crawl completo)."""
+        p95 = self.p95(store, "total")
+        return None if p95 is None else max(HEDGE_MIN_S, p95)
+
+    # --- Circuit breaker ---
+
+    def is_open(self, store: str) -> bool:
+        return self._open_until.get(store, 0) > time.monotonic()
+
+    def success(self, store: str):
+        self._failures[store] = 0
+        self._timeouts[store] = 0
+        self._open_until.pop(store, None)
+
+    def timeout(self, store: str) -> bool:
+        """Timeout no concluyente; regresa True si ya son TIMEOUTS_TO_FAIL seguidos (cuenta como falla)."""
+        self._timeouts[store] = self._timeouts.get(store, 0) + 1
+        return self._timeouts[store] >= TIMEOUTS_TO_FAIL
+
+    def failure(self, store: str) -> bool:
+        """Regresa True si esta falla abrió el breaker."""
+        self._failures[store] = self._failures.get(store, 0) + 1
+        if self._failures[store] >= FAILURES_TO_OPEN and not self.is_open(store):
+            self._open_until[store] = time.monotonic() + COOLDOWN_S
+            print(f"🚧 [Health] {store}: {self._failures[store]} fallas seguidas, se omite por {COOLDOWN_S / 60:.0f} min")
+            return True
+        return False
+
+    def snapshot(self) -> dict:
+        return {
+            store: {
+                "p95_s": {kind: (round(p, 3) if (p := self.p95(store, kind)) is not None else None) for kind in kinds},
+                "goto_timeout_ms": self.goto_timeout_ms(store),
+                "wait_timeout_ms": self.wait_timeout_ms(store),
+                "consecutive_failures": self._failures.get(store, 0),
+                "circuit_open": self.is_open(store),
+            }
+            for store, kinds in self._samples.items()
+        }
@@ -0,0 +1,243 @@
+"""
+Índice agregado de queries rastreadas: tracked_queries/{query_lowercase}.
+
+Una entrada por query distinta con:
+  query          -> texto original (el primero visto)
+  queries        -> todas las variantes de mayúsculas con que la guardaron los usuarios
+                    (los trackings se buscan por su campo `query` exacto: toques de
+                    last_updated y alertas deben cubrirlas todas)
+  subscribers    -> cuántos documentos users/*/tracking la siguen
+  last_updated   -> el last_updated MÁS VIEJO entre esos documentos (fuerza actualización)
+
+El frontend escribe users/*/tracking directo en Firestore, así que el índice se
+valida donde se usa. Antes de confiar en él, el scraper revisa dos cosas baratas:
+  - count() de collection_group('tracking') contra la suma de `subscribers`
+    (detecta bajas y altas netas; una agregación, no se leen los documentos)
+  - el created_at más nuevo de los trackings contra synced_at de
+    tracked_queries_meta/state (detecta altas aunque una baja deje el conteo igual)
+Si cualquiera falla corre rebuild(). El escaneo completo solo ocurre cuando algún
+usuario agregó o quitó productos desde la última sincronización.
+
+Opcionalmente (TRACKED_INDEX_LISTENER=1, para instancias del API siempre
+encendidas) un listener lo mantiene al día entre corridas: cada alta/baja/cambio
+re-agrega solo su query. Con Cloud Run escalando a cero no sirve de garantía y
+cada arranque en frío relee todos los trackings, por eso no es el default.
+"""
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+INDEX_COLLECTION = "tracked_queries"
+META_DOC = ("tracked_queries_meta", "state")
+BATCH_LIMIT = 500
+
+
+def _iso(value) -> Optional[str]:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, str) and value:
+        return value
+    return None
+
+
+def parse_tracking(doc) -> Optional[Tuple[str, str, Optional[str]]]:
+    """(clave, query, last_updated_iso) de un documento users/*/tracking."""
+    data = doc.to_dict() or {}
+    q = data.get("query") or data.get("query_term") or doc.id
+    if not q:
+        return None
+    return q.lower(), q, _iso(data.get("last_updated"))
+
+
+def aggregate(rows: Iterable[Tuple[str, str, Optional[str]]]) -> Dict[str, dict]:
+    """Agrupa filas de tracking por query; conserva el last_updated más viejo."""
+    entries: Dict[str, dict] = {}
+    for key, query, last_updated in rows:
+        entry = entries.get(key)
+        if entry is None:
+            entries[key] = {"query": query, "queries": [query], "subscribers": 1, "last_updated": last_updated}
+            continue
+        entry["subscribers"] += 1
+        if query not in entry["queries"]:
+            entry["queries"] = sorted(entry["queries"] + [query])
+        # ISO-8601 del mismo formato se compara como texto; None = nunca actualizado (gana)
+        prev = entry["last_updated"]
+        if prev is not None and (last_updated is None or last_updated < prev):
+            entry["last_updated"] = last_updated
+    return entries
+
+
+def read_index(db) -> List[dict]:
+    """Entradas del índice listas para el scraper."""
+    out = []
+    for doc in db.collection(INDEX_COLLECTION).stream():
+        data = doc.to_dict() or {}
+        if not data.get("subscribers"):
+            continue
+        query = data.get("query") or data.get("query_term") or doc.id
+        out.append({
+            "query": query,
+            "queries": data.get("queries"),  # None = entrada anterior a las variantes (is_stale la repara)
+            "last_updated": data.get("last_updated"),
+            "subscribers": data.get("subscribers", 0),
+        })
+    return out
+
+
+def tracking_count(db) -> Optional[int]:
+    """Número de documentos users/*/tracking vía count(); None si la agregación falla."""
+    try:
+        result = db.collection_group("tracking").count(alias="n").get()
+        return int(result[0][0].value)
+    except Exception as e:
+        print(f"⚠️ [Index] No se pudo contar trackings: {e}")
+        return None
+
+
+def _meta_ref(db):
+    return db.collection(META_DOC[0]).document(META_DOC[1])
+
+
+def mark_synced(db, at: Optional[datetime] = None):
+    """Sella el momento en que el índice quedó al día con users/*/tracking."""
+    _meta_ref(db).set({"synced_at": at or datetime.now(timezone.utc)})
+
+
+def newest_tracking(db) -> Optional[datetime]:
+    """created_at del tracking más reciente (índice de collection group en created_at)."""
+    docs = list(db.collection_group("tracking").order_by("created_at", direction="DESCENDING").limit(1).stream())
+    if not docs:
+        return None
+    value = (docs[0].to_dict() or {}).get("created_at")
+    return value if isinstance(value, datetime) else None
+
+
+def is_stale(db, entries: List[dict]) -> bool:
+    """True si el índice no cubre los trackings actuales (altas o bajas sin indexar)."""
+    if any(not e.get("queries") for e in entries):
+        print("🗂️ [Index] Entradas sin variantes de mayúsculas: reconstruyendo")
+        return True
+    expected = tracking_count(db)
+    indexed = sum(int(e.get("subscribers") or 0) for e in entries)
+    if expected is not None and expected != indexed:
+        print(f"🗂️ [Index] Desfasado: {indexed} suscripciones indexadas vs {expected} trackings")
+        return True
+    try:
+        newest = newest_tracking(db)
+        meta = _meta_ref(db).get()
+        synced_at = (meta.to_dict() or {}).get("synced_at") if meta.exists else None
+    except Exception as e:
+        print(f"⚠️ [Index] No se pudo revisar altas recientes: {e}")
+        return False
+    if newest is not None and (synced_at is None or newest > synced_at):
+        print(f"🗂️ [Index] Desfasado: tracking creado {newest.isoformat()} después de la última sincronización")
+        return True
+    return False
+
+
+def _existing(db) -> Dict[str, dict]:
+    existing = {}
+    for doc in db.collection(INDEX_COLLECTION).stream():
+        data = doc.to_dict() or {}
+        existing[doc.id] = {k: data.get(k) for k in ("query", "queries", "subscribers", "last_updated")}
+    return existing
+
+
+def write_diff(db, wanted: Dict[str, Optional[dict]], current: Dict[str, dict]) -> int:
+    """Escribe solo las entradas que cambiaron (None = borrar). Regresa cuántas escribió."""
+    ops = []
+    for key, entry in wanted.items():
+        if entry == current.get(key):
+            continue
+        ref = db.collection(INDEX_COLLECTION).document(key)
+        if entry is None:
+            if key in current:
+                ops.append(("delete", ref, None))
+        else:
+            ops.append(("set", ref, {**entry, "query_term": key, "indexed_at": datetime.now().isoformat()}))
+    for i in range(0, len(ops), BATCH_LIMIT):
+        batch = db.batch()
+        for kind, ref, data in ops[i:i + BATCH_LIMIT]:
+            if kind == "delete":
+                batch.delete(ref)
+            else:
+                batch.set(ref, data)
+        batch.commit()
+    for key, entry in wanted.items():
+        if entry is None:
+            current.pop(key, None)
+        else:
+            current[key] = entry
+    return len(ops)
+
+
+def rebuild(db) -> List[dict]:
+    """Escaneo completo de users/*/tracking para crear o reparar el índice."""
+    # El sello se toma antes del escaneo: un alta durante el escaneo fuerza otro rebuild
+    started = datetime.now(timezone.utc)
+    rows = [row for row in (parse_tracking(doc) for doc in db.collection_group("tracking").stream()) if row]
+    wanted: Dict[str, Optional[dict]] = aggregate(rows)
+    current = _existing(db)
+    for stale in set(current) - set(wanted):
+        wanted[stale] = None
+    written = write_diff(db, wanted, current)
+    mark_synced(db, started)
+    print(f"🗂️ [Index] Reconstruido: {len(rows)} trackings -> {len(current)} queries ({written} escrituras)")
+    return [{"query": e["query"], "queries": e.get("queries") or [e["query"]],
+             "last_updated": e["last_updated"], "subscribers": e["subscribers"]}
+            for e in current.values() if e]
+
+
+class TrackedIndexMaintainer:
+    """Listener que mantiene tracked_queries al día con los cambios de los usuarios."""
+
+    def __init__(self):
+        self._rows: Dict[str, Tuple[str, str, Optional[str]]] = {}  # path -> fila
+        self._written: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._watch = None
+        self._db = None
+        self._initial = True
+
+    def start(self, db):
+        if self._watch or not db:
+            return
+        self._db = db
+        self._written = _existing(db)
+        self._watch = db.collection_group("tracking").on_snapshot(self._on_snapshot)
+        print("👂 [Index] Escuchando cambios en users/*/tracking.")
+
+    def stop(self):
+        if self._watch:
+            try:
+                self._watch.unsubscribe()
+            except Exception:
+                pass
+            self._watch = None
+
+    def _on_snapshot(self, docs, changes, read_time):
+        try:
+            with self._lock:
+                affected = set()
+                for change in changes:
+                    path = change.document.reference.path
+                    old = self._rows.pop(path, None)
+                    if old:
+                        affected.add(old[0])
+                    if change.type.name != "REMOVED":
+                        row = parse_tracking(change.document)
+                        if row:
+                            self._rows[path] = row
+                            affected.add(row[0])
+                if self._initial:
+                    # Primer snapshot = estado completo: también limpia entradas huérfanas
+                    affected |= set(self._written)
+                    self._initial = False
+                if not affected:
+                    return
+                entries = aggregate(row for row in self._rows.values() if row[0] in affected)
+                wanted = {key: entries.get(key) for key in affected}
+                write_diff(self._db, wanted, self._written)
+                mark_synced(self._db, read_time if isinstance(read_time, datetime) else None)
+        except Exception as e:
+            print(f"⚠️ [Index] Error actualizando índice: {e}")
@@ -0,0 +1,143 @@
+"""
+Escrituras write-behind a Firestore para el scraper programado.
+
+En lugar de un set() / batch.commit() síncrono por query, la corrida encola las
+mutaciones y las manda juntas en batches de hasta 500 operaciones. Antes de escribir
+se leen (en una sola llamada get_all) los content_hash guardados: si nombres, precios
+y URLs no cambiaron, el documento no se reescribe, a menos que su updated_at sea más
+viejo que `refresh_after_hours` (para que la caché de 24h no caduque).
+Los last_updated de users/*/tracking solo se tocan para queries que sí se escribieron.
+
+Si un flush falla, nada de lo que no se confirmó se pierde: lo pendiente vuelve a la
+cola (o, si ya se armaron los batches, las operaciones sin commit quedan para el
+siguiente flush, antes que las nuevas).
+"""
+import hashlib
+import json
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Union
+
+import metrics
+
+BATCH_LIMIT = 500
+IN_QUERY_LIMIT = 30  # máximo de valores en un filtro "in" de Firestore
+
+
+def content_hash(items: List[dict]) -> str:
+    """Hash estable de lo que le importa al usuario: tienda, nombre, precio y URL."""
+    key = sorted(
+        (str(i.get("store") or ""), str(i.get("name") or ""), float(i.get("price") or 0), str(i.get("url") or ""))
+        for i in items
+    )
+    return hashlib.sha1(json.dumps(key, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class WriteBuffer:
+    def __init__(self, db, refresh_after_hours: float = 6, flush_every: int = 200, auto_flush: bool = True):
+        self.db = db
+        self.refresh_after = timedelta(hours=refresh_after_hours)
+        self.flush_every = flush_every
+        # Sin auto_flush el llamador revisa needs_flush() y corre flush() fuera del event loop
+        self.auto_flush = auto_flush
+        self._sets: Dict[str, dict] = {}
+        # Operaciones ya resueltas (hash revisado) que no alcanzaron commit en un flush fallido
+        self._retry: List[tuple] = []
+        self._lock = threading.Lock()
+        self.stats = {"written": 0, "skipped": 0, "touched": 0, "commits": 0}
+
+    def __len__(self):
+        return len(self._sets) + len(self._retry)
+
+    def set_doc(self, collection: str, doc_id: str, data: dict, touch_query: Optional[Union[str, List[str]]] = None,
+                check_hash: bool = True):
+        """
+        Encola un set() completo. Con check_hash, `data` debe traer content_hash y updated_at
+        y se omite si no cambió; sin él se escribe siempre (p.ej. estado interno del scraper).
+        `touch_query`: valor(es) del campo `query` de los trackings cuyo last_updated se toca
+        si el documento se escribe.
+        """
+        if not self.db:
+            return
+        ref = self.db.collection(collection).document(doc_id)
+        with self._lock:
+            self._sets[ref.path] = {"ref": ref, "data": data, "touch": touch_query, "check_hash": check_hash}
+        if self.auto_flush and self.needs_flush():
+            self.flush()
+
+    def needs_flush(self) -> bool:
+        return len(self) >= self.flush_every
+
+    def _is_fresh(self, previous: dict, new_hash: str) -> bool:
+        if previous.get("content_hash") != new_hash:
+            return False
+        try:
+            return datetime.now() - datetime.fromisoformat(previous["updated_at"]) < self.refresh_after
+        except Exception:
+            return False
+
+    @metrics.timed("firestore_op_seconds", op="buffer_flush")
+    def flush(self):
+        with self._lock:
+            if not self.db or not (self._sets or self._retry):
+                return
+            pending = list(self._sets.values())
+            retry = self._retry
+            self._sets, self._retry = {}, []
+        ops, committed = None, 0
+        try:
+            touches = set()
+
+            # 1. Hashes previos en una sola lectura
+            previous = {}
+            hashed = [p["ref"] for p in pending if p["check_hash"]]
+            if hashed:
+                for snap in self.db.get_all(hashed, field_paths=["content_hash", "updated_at"]):
+                    if snap.exists:
+                        previous[snap.reference.path] = snap.to_dict() or {}
+
+            writes = []
+            for p in pending:
+                prev = previous.get(p["ref"].path)
+                if prev and self._is_fresh(prev, p["data"].get("content_hash")):
+                    self.stats["skipped"] += 1
+                    continue
+                writes.append(("set", p["ref"], p["data"]))
+                if p["touch"]:
+                    touches.update([p["touch"]] if isinstance(p["touch"], str) else p["touch"])
+
+            # 2. last_updated de los trackings de usuarios (solo queries escritas)
+            now = datetime.now().isoformat()
+            touches = sorted(touches)
+            for i in range(0, len(touches), IN_QUERY_LIMIT):
+                docs = self.db.collection_group("tracking").where("query", "in", touches[i:i + IN_QUERY_LIMIT]).stream()
+                for doc in docs:
+                    writes.append(("update", doc.reference, {"last_updated": now}))
+
+            # 3. Commits en batches (los reintentos de un flush anterior van primero)
+            ops = retry + writes
+            for i in range(0, len(ops), BATCH_LIMIT):
+                chunk = ops[i:i + BATCH_LIMIT]
+                batch = self.db.batch()
+                for kind, ref, data in chunk:
+                    if kind == "set":
+                        batch.set(ref, data)
+                    else:
+                        batch.update(ref, data)
+                batch.commit()
+                committed = i + len(chunk)
+                self.stats["commits"] += 1
+                self.stats["written"] += sum(1 for kind, _, _ in chunk if kind == "set")
+                self.stats["touched"] += sum(1 for kind, _, _ in chunk if kind == "update")
+        except Exception as e:
+            self._requeue(pending, retry if ops is None else ops[committed:], ops is None)
+            print(f"Error flushing write buffer ({len(self)} escrituras pendientes para el siguiente flush): {e}")
+
+    def _requeue(self, pending: List[dict], ops: List[tuple], before_commits: bool):
+        """Regresa a la cola lo que no se confirmó, sin pisar lo encolado durante el flush."""
+        with self._lock:
+            if before_commits:
+                for p in pending:
+                    self._sets.setdefault(p["ref"].path, p)
+            # Un set más nuevo del mismo documento ya encolado gana sobre el reintento
+            self._retry = [op for op in ops if not (op[0] == "set" and op[1].path in self._sets)] + self._retry